@@ -43,6 +43,10 @@ setup(
     test_suite="tests.unit",
     dependency_links=[],
     install_requires=[],
+    extras_require={
+        # vector, capture and export.load_transactions
+        "numpy": ["numpy"],
+    },
     setup_requires=["pytest-runner", "behave"],
     python_requires=f">={'.'.join([str(x) for x in PYTHON_VERSION])}",
     zip_safe=False,
@@ -0,0 +1,680 @@
+"""
+Offline batch decoding of recorded I²C packet streams.
+
+Runs the PCA9534 decoder over a stream of lower layer i2c packets without
+PulseView or libsigrokdecode stacking. The decoder is hosted by a small
+stand-in for `srd.Decoder.register`/`srd.Decoder.put` which collects the
+annotations, forwarded OUTPUT_PYTHON packets and 'pca9534' events into flat
+arrays, or hands them to a sink as they are produced.
+
+Packet files are a fixed size binary record stream:
+
+    header:  b"PCA9534P" + uint16 version
+    record:  uint64 ss, uint64 es, uint8 cmd, int16 value (-1 for None)
+
+'BITS' packets are not stored, the PCA9534 decoder never looks at them.
+
+decode_parallel() splits a capture at STOP conditions into chunks that are
+decoded by a pool of worker processes. Given a packet file every worker
+reads its own chunk from it, and sends back flat arrays rather than Python
+objects, so the parent does little more than stitch. A chunk only depends on
+the ones before it through the register pointer and the shadow registers of
+each device, workers start with both unknown and the results are stitched in
+capture order: reads that relied on the pointer of an earlier chunk get
+their register and annotation text filled in, and pin changes are checked
+against the register values carried over. The output is the same as that of
+decode_packets(), the forwarded i2c packets are only collected on request.
+
+iter_decode() and aiter_decode() serve live acquisition: they run the
+decoder in 'streaming' mode and yield its output as soon as it is produced.
+"""
+
+import array
+import os
+import struct
+from collections import deque
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import sigrokdecode as srd
+
+from .pd import (
+    ACK,
+    ADDR_READ,
+    ADDR_WRITE,
+    DATA_READ,
+    DATA_WRITE,
+    CMD_DATA_READ,
+    DIR_READ,
+    DIR_WRITE,
+    NACK,
+    PIN_CHANGE,
+    RESTART,
+    START,
+    STOP,
+    TRANSACTION,
+    Decoder,
+    DeviceModel,
+    _burst_text,
+    _read_text,
+    device_model,
+    shadow_changes,
+)
+
+PACKET_FILE_MAGIC = b"PCA9534P"
+PACKET_FILE_VERSION = 1
+
+_HEADER = struct.Struct("<8sH")
+_RECORD = struct.Struct("<QQBh")
+_READ_CHUNK = _RECORD.size * 64 * 1024
+
+# Command codes as stored in packet files. Never reorder, append only.
+FILE_COMMANDS = (START, RESTART, STOP, ACK, NACK, ADDR_READ, ADDR_WRITE, DATA_READ, DATA_WRITE)
+_FILE_CODES = {cmd: code for code, cmd in enumerate(FILE_COMMANDS)}
+
+Packet = Tuple[int, int, list]
+# sink(output_id, ss, es, data), output_id is one of OUT_ANN, OUT_I2C, OUT_EVENTS
+Sink = Callable[[int, int, int, list], None]
+
+
+class BatchResult:
+    """
+    Columnar output of a batch decode.
+    Annotations: ann_ss[i], ann_es[i], ann_class[i], ann_text[i]
+    OUTPUT_PYTHON 'i2c': py_ss[i], py_es[i], py_data[i]
+    OUTPUT_PYTHON 'pca9534': event_ss[i], event_es[i], event_data[i]
+    """
+
+    def __init__(self):
+        self.ann_ss = array.array("Q")
+        self.ann_es = array.array("Q")
+        self.ann_class = array.array("B")
+        self.ann_text: List[List[str]] = []
+        self.py_ss = array.array("Q")
+        self.py_es = array.array("Q")
+        self.py_data: List[list] = []
+        self.event_ss = array.array("Q")
+        self.event_es = array.array("Q")
+        self.event_data: List[list] = []
+
+    def annotations(self) -> Iterator[Tuple[int, int, int, List[str]]]:
+        return zip(self.ann_ss, self.ann_es, self.ann_class, self.ann_text)
+
+    def python(self) -> Iterator[Tuple[int, int, list]]:
+        return zip(self.py_ss, self.py_es, self.py_data)
+
+    def events(self) -> Iterator[Tuple[int, int, list]]:
+        return zip(self.event_ss, self.event_es, self.event_data)
+
+
+# Output ids handed out by the stand-in register()
+OUT_ANN = 0
+OUT_I2C = 1
+OUT_EVENTS = 2
+
+
+class _BatchDecoder(Decoder):
+    """Decoder hosted outside of libsigrokdecode, `put` lands in a BatchResult."""
+
+    def __init__(self, result: BatchResult):
+        self._result = result
+        super().__init__()
+
+    def register(self, output_type, proto_id=None, meta=None):
+        if output_type == srd.OUTPUT_ANN:
+            return OUT_ANN
+        return OUT_EVENTS if proto_id == "pca9534" else OUT_I2C
+
+    def put(self, startsample, endsample, output_id, data):
+        result = self._result
+        if output_id == OUT_ANN:
+            result.ann_ss.append(startsample)
+            result.ann_es.append(endsample)
+            result.ann_class.append(data[0])
+            result.ann_text.append(data[1])
+        elif output_id == OUT_I2C:
+            result.py_ss.append(startsample)
+            result.py_es.append(endsample)
+            result.py_data.append(data)
+        else:
+            result.event_ss.append(startsample)
+            result.event_es.append(endsample)
+            result.event_data.append(data)
+
+
+class _SinkDecoder(Decoder):
+    """Decoder hosted outside of libsigrokdecode, `put` is handed straight to a sink, nothing is kept."""
+
+    def __init__(self, sink: Sink):
+        self._sink = sink
+        super().__init__()
+
+    register = _BatchDecoder.register
+
+    def put(self, startsample, endsample, output_id, data):
+        self._sink(output_id, startsample, endsample, data)
+
+
+# Event kinds of a _ChunkResult
+_EVENT_TRANSACTION = 0
+_EVENT_PIN_CHANGE = 1
+_OTHER_CODE = 255  # Forwarded packet without a packet file command code, its data is in py_other
+
+
+class _ChunkResult:
+    """
+    Output of one chunk of decode_parallel(), kept in flat arrays so it is
+    cheap to send back from a worker. Annotation texts are numbers into
+    `texts`. Events are an _EVENT_* kind and five integers each, the fields
+    of the event tuple with -1 for None. Forwarded packets are a packet file
+    command code and value each, only kept when `forwarded` is set.
+    """
+
+    def __init__(self, forwarded: bool):
+        self.forwarded = forwarded
+        self.ann_ss = array.array("Q")
+        self.ann_es = array.array("Q")
+        self.ann_class = array.array("B")
+        self.ann_text = array.array("I")
+        self.texts: List[Tuple[str, ...]] = []
+        self._text_ids: Dict[Tuple[str, ...], int] = {}
+        self.py_ss = array.array("Q")
+        self.py_es = array.array("Q")
+        self.py_code = array.array("B")
+        self.py_value = array.array("h")
+        self.py_other: List[list] = []
+        self.event_ss = array.array("Q")
+        self.event_es = array.array("Q")
+        self.event_kind = array.array("B")
+        self.event_fields = array.array("h")
+        self.first_changes = array.array("I")  # Events of pin changes whose old value the worker did not know
+
+    def add(self, ss, es, output_id, data):
+        if output_id == OUT_ANN:
+            text = tuple(data[1])
+            text_id = self._text_ids.get(text)
+            if text_id is None:
+                text_id = self._text_ids[text] = len(self.texts)
+                self.texts.append(text)
+            self.ann_ss.append(ss)
+            self.ann_es.append(es)
+            self.ann_class.append(data[0])
+            self.ann_text.append(text_id)
+        elif output_id == OUT_I2C:
+            if not self.forwarded:
+                return
+            cmd, value = data
+            code = _FILE_CODES.get(cmd)
+            if code is None:
+                code = _OTHER_CODE
+                value = None
+                self.py_other.append(data)
+            self.py_ss.append(ss)
+            self.py_es.append(es)
+            self.py_code.append(code)
+            self.py_value.append(-1 if value is None else value)
+        else:
+            kind, fields = data
+            if kind == TRANSACTION:
+                address, direction, reg, value, ack = fields
+                fields = (address, direction == DIR_READ, -1 if reg is None else reg, -1 if value is None else value, ack)
+                self.event_kind.append(_EVENT_TRANSACTION)
+            else:
+                address, reg, pin, old, new = fields
+                if old is None:
+                    self.first_changes.append(len(self.event_kind))
+                    old = -1
+                fields = (address, reg, pin, old, new)
+                self.event_kind.append(_EVENT_PIN_CHANGE)
+            self.event_ss.append(ss)
+            self.event_es.append(es)
+            self.event_fields.extend(fields)
+
+    def __len__(self) -> int:
+        return len(self.event_kind)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_text_ids"]  # Only needed while decoding
+        return state
+
+    def annotation_texts(self) -> List[List[str]]:
+        texts = self.texts
+        return [list(texts[i]) for i in self.ann_text]
+
+    def python(self) -> List[list]:
+        """The forwarded packets' data."""
+        commands = FILE_COMMANDS
+        other = iter(self.py_other)
+        return [
+            next(other) if code == _OTHER_CODE else [commands[code], None if value < 0 else value]
+            for code, value in zip(self.py_code, self.py_value)
+        ]
+
+    def event(self, i: int) -> list:
+        """Data of event `i` alone."""
+        a, b, c, d, e = self.event_fields[5 * i:5 * i + 5]
+        if self.event_kind[i] == _EVENT_TRANSACTION:
+            return [TRANSACTION, (a, DIR_READ if b else DIR_WRITE, None if c < 0 else c, None if d < 0 else d, e == 1)]
+        return [PIN_CHANGE, (a, b, c, None if d < 0 else d, e)]
+
+    def event_data(self) -> List[list]:
+        fields = iter(self.event_fields)
+        return [
+            [TRANSACTION, (a, DIR_READ if b else DIR_WRITE, None if c < 0 else c, None if d < 0 else d, e == 1)]
+            if kind == _EVENT_TRANSACTION
+            else [PIN_CHANGE, (a, b, c, None if d < 0 else d, e)]
+            for kind, (a, b, c, d, e) in zip(self.event_kind, zip(fields, fields, fields, fields, fields))
+        ]
+
+
+class _ChunkDecoder(_BatchDecoder):
+    """
+    Decodes one chunk of a parallel decode into a _ChunkResult. Nothing is
+    known about the devices at the start of the chunk, reads whose register
+    pointer was set by an earlier chunk are recorded in `unresolved` as
+    (index of the first event, annotation index or -1, (data byte ss, data
+    byte es) per byte). `forgotten` are the addresses whose pointer a grammar
+    violation made unknown within the chunk.
+    """
+
+    def __init__(self, result: _ChunkResult):
+        super().__init__(result)
+        self.unresolved: List[Tuple[int, int, Tuple[Tuple[int, int], ...]]] = []
+        self.forgotten = set()
+        self._pending: Optional[Tuple[int, Tuple[Tuple[int, int], ...]]] = None
+
+    def start(self):
+        super().start()
+        for device in self._devices:
+            if device is not None:
+                device.regs = [None] * len(self._model.power_on)
+
+    def put(self, startsample, endsample, output_id, data):
+        self._result.add(startsample, endsample, output_id, data)
+
+    def _report_stats(self):
+        # A report per chunk would be meaningless, read decoder.stats() instead.
+        pass
+
+    def pointers(self) -> Dict[int, Optional[int]]:
+        """Register pointer by address at the end of the chunk, for the devices whose pointer the chunk determined."""
+        return {
+            device.address: device.reg_pointer
+            for device in self._devices
+            if device is not None and (device.reg_pointer is not None or device.address in self.forgotten)
+        }
+
+    def registers(self) -> Dict[int, List[Optional[int]]]:
+        """Shadow registers by address at the end of the chunk, None for the registers the chunk did not see."""
+        return {device.address: device.regs for device in self._devices if device is not None}
+
+    def _forget_pointer(self, device):
+        super()._forget_pointer(device)
+        self.forgotten.add(device.address)
+
+    def msg_read_from_register(self, packets, txn):
+        if txn.data != -1 and txn.device.reg_pointer is None and txn.device.address not in self.forgotten:
+            data = self._data_bytes(packets, txn.data, CMD_DATA_READ) if self._model.auto_increment else (txn.data, )
+            self._pending = (len(self._result), tuple((packets.ss[i], packets.es[i]) for i in data))
+        return super().msg_read_from_register(packets, txn)
+
+    def _put_gui_text(self, packets, txn, builder, last):
+        super()._put_gui_text(packets, txn, builder, last)
+        if self._pending is not None:
+            event, spans = self._pending
+            self._pending = None
+            self.unresolved.append((event, len(self._result.ann_text) - 1 if self._annotate else -1, spans))
+
+
+def default_options() -> Dict[str, object]:
+    """Decoder option defaults, with 'events' on: the batch host keeps them apart from the i2c packets."""
+    options = {opt["id"]: opt["default"] for opt in Decoder.options}
+    options["events"] = "yes"
+    return options
+
+
+def create_decoder(result: Optional[BatchResult], options: Optional[Dict[str, object]] = None, sink: Optional[Sink] = None) -> Decoder:
+    """A started decoder whose output is collected in `result`, or passed to `sink` when one is given."""
+    decoder = _SinkDecoder(sink) if sink is not None else _BatchDecoder(result)
+    decoder.options = default_options()
+    decoder.options.update(options or {})
+    decoder.reset()
+    decoder.start()
+    return decoder
+
+
+def decode_packets(packets: Iterable[Packet], options: Optional[Dict[str, object]] = None) -> BatchResult:
+    """
+    Run the full PCA9534 decoder over `packets`, an iterable of
+    (start_sample, end_sample, [cmd, value]) as produced by the i2c decoder.
+    """
+    result = BatchResult()
+    decoder = create_decoder(result, options)
+    decode = decoder.decode
+    for ss, es, data in packets:
+        decode(ss, es, data)
+    decoder.flush()
+    return result
+
+
+def _streaming_decoder(options: Optional[Dict[str, object]]):
+    """A streaming decoder and the queue its output lands in as (output_id, ss, es, data)."""
+    queue = deque()
+    opts = {"streaming": "yes"}
+    opts.update(options or {})
+    decoder = create_decoder(None, opts, lambda output_id, ss, es, data: queue.append((output_id, ss, es, data)))
+    return decoder, queue
+
+
+def iter_decode(packets: Iterable[Packet], options: Optional[Dict[str, object]] = None) -> Iterator[Tuple[int, int, int, list]]:
+    """
+    Decode `packets` as they arrive and yield (output_id, ss, es, data) as
+    soon as the decoder produces it. A transaction left incomplete when
+    `packets` ends is flushed.
+    """
+    decoder, queue = _streaming_decoder(options)
+    decode = decoder.decode
+    for ss, es, data in packets:
+        decode(ss, es, data)
+        while queue:
+            yield queue.popleft()
+    decoder.flush()
+    yield from queue
+
+
+async def aiter_decode(
+    packets: AsyncIterable[Packet], options: Optional[Dict[str, object]] = None
+) -> AsyncIterator[Tuple[int, int, int, list]]:
+    """iter_decode() for an asynchronous packet source."""
+    decoder, queue = _streaming_decoder(options)
+    decode = decoder.decode
+    async for ss, es, data in packets:
+        decode(ss, es, data)
+        while queue:
+            yield queue.popleft()
+    decoder.flush()
+    while queue:
+        yield queue.popleft()
+
+
+def _chunk_decoder(options: Optional[Dict[str, object]], forwarded: bool) -> _ChunkDecoder:
+    decoder = _ChunkDecoder(_ChunkResult(forwarded))
+    decoder.options = default_options()
+    decoder.options.update(options or {})
+    decoder.options["events"] = "yes"  # Stitching needs them, the _Stitcher drops them unless asked for
+    decoder.reset()
+    decoder.start()
+    return decoder
+
+
+def _decode_chunk(packets: List[Packet], options: Optional[Dict[str, object]], forwarded: bool):
+    """Worker side of decode_parallel() for packets handed over by the caller."""
+    decoder = _chunk_decoder(options, forwarded)
+    decode = decoder.decode
+    for ss, es, data in packets:
+        decode(ss, es, data)
+    decoder.flush()
+    return decoder._result, decoder.unresolved, decoder.pointers(), decoder.registers()  # pylint: disable=protected-access
+
+
+def _decode_file_chunk(path: str, index: int, chunk_packets: int, options: Optional[Dict[str, object]], forwarded: bool):
+    """
+    Worker side of decode_parallel() for a packet file, reads and decodes
+    chunk `index` itself. Chunks are cut after the first STOP at or past
+    every multiple of `chunk_packets` records: the worker skips up to that
+    STOP for its own multiple and decodes up to the one for the next. When
+    both are the same STOP the chunk is empty.
+    """
+    decoder = _chunk_decoder(options, forwarded)
+    decode = decoder.decode
+    commands = FILE_COMMANDS
+    stop = _FILE_CODES[STOP]
+    first = index * chunk_packets
+    end = first + chunk_packets
+    with open(path, "rb") as f:
+        f.seek(_HEADER.size + first * _RECORD.size)
+        records = enumerate(_unpack_records(f), first)
+        empty = False
+        if index:
+            for i, (_, _, code, _) in records:
+                if code == stop:
+                    empty = i >= end
+                    break
+        if not empty:
+            for i, (ss, es, code, value) in records:
+                decode(ss, es, [commands[code], None if value < 0 else value])
+                if code == stop and i >= end:
+                    break
+    decoder.flush()
+    return decoder._result, decoder.unresolved, decoder.pointers(), decoder.registers()  # pylint: disable=protected-access
+
+
+def _split_at_stops(packets: Iterable[Packet], chunk_packets: int) -> Iterator[List[Packet]]:
+    """Chunks of at least `chunk_packets` packets, each but the last ending with a STOP."""
+    chunk = []
+    for packet in packets:
+        chunk.append(packet)
+        if len(chunk) >= chunk_packets and packet[2][0] == STOP:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Stitcher:
+    """
+    Appends chunk results in capture order, carrying register pointers and
+    shadow registers across chunks. A worker knows what its chunk did to
+    the pointers and registers except for the reads listed as unresolved,
+    and those come before anything else the chunk does to their device. So
+    only those reads and the first pin changes of every register the chunk
+    touched depend on the earlier chunks, all other events are copied.
+    Workers always produce events, without `events` they are only used to
+    stitch and not kept.
+    """
+
+    def __init__(self, result: BatchResult, model: DeviceModel, events: bool = True):
+        self.result = result
+        self._model = model
+        self._events = events
+        self._pointers: Dict[int, Optional[int]] = {}
+        self._regs: Dict[int, List[Optional[int]]] = {}
+
+    def add(
+        self,
+        chunk: _ChunkResult,
+        unresolved: List[Tuple[int, int, Tuple[Tuple[int, int], ...]]],
+        chunk_pointers: Dict[int, Optional[int]],
+        chunk_regs: Dict[int, List[Optional[int]]],
+    ):
+        result = self.result
+        ann_offset = len(result.ann_text)
+        result.ann_ss.extend(chunk.ann_ss)
+        result.ann_es.extend(chunk.ann_es)
+        result.ann_class.extend(chunk.ann_class)
+        result.ann_text.extend(chunk.annotation_texts())
+        if chunk.forwarded:
+            result.py_ss.extend(chunk.py_ss)
+            result.py_es.extend(chunk.py_es)
+            result.py_data.extend(chunk.python())
+
+        # (annotation index, data byte ss, data byte es, last byte of the read) by event index
+        fixups = {
+            event + k: (ann, ss, es, k == len(spans) - 1) for event, ann, spans in unresolved for k, (ss, es) in enumerate(spans)
+        }
+        model = self._model
+        pointers = self._pointers
+        event_ss = chunk.event_ss
+        event_es = chunk.event_es
+        events = chunk.event_data() if self._events else None
+        accesses = []  # (register, value) of the read being resolved
+        copied = 0
+        for i in sorted(fixups.keys() | set(chunk.first_changes)):
+            self._copy(event_ss, event_es, events, copied, i)
+            copied = i + 1
+            ss, es, data = event_ss[i], event_es[i], chunk.event(i) if events is None else events[i]
+            regs = self._device_regs(data[1][0])
+            fixup = fixups.get(i)
+            if fixup is None:
+                # The worker saw this register for the first time, compare with what the earlier chunks left.
+                address, reg, pin, _, new = data[1]
+                if regs[reg] is not None:
+                    old = (regs[reg] >> pin) & 1
+                    if old == new:
+                        continue
+                    data = [PIN_CHANGE, (address, reg, pin, old, new)]
+                self._put_event(ss, es, data)
+                continue
+
+            address, direction, reg, value, ack = data[1]
+            if pointers.get(address) is None:
+                self._put_event(ss, es, data)
+                continue
+            reg = pointers[address]
+            ann, data_ss, data_es, last = fixup
+            self._put_event(ss, es, [TRANSACTION, (address, direction, reg, value, ack)])
+            accesses.append((reg, value))
+            if last:
+                if ann >= 0:
+                    text = _read_text(model, address, reg, value) if len(accesses) == 1 else _burst_text(model, address, DIR_READ, tuple(accesses))
+                    result.ann_text[ann_offset + ann] = list(text)
+                accesses = []
+            for pin, old, new in shadow_changes(regs, reg, value):
+                self._put_event(data_ss, data_es, [PIN_CHANGE, (address, reg, pin, old, new)])
+            pointers[address] = model.next_register(reg)
+        self._copy(event_ss, event_es, events, copied, len(event_ss))
+
+        pointers.update(chunk_pointers)
+        for address, values in chunk_regs.items():
+            regs = self._device_regs(address)
+            for reg, value in enumerate(values):
+                if value is not None:
+                    regs[reg] = value
+
+    def _device_regs(self, address: int) -> List[Optional[int]]:
+        regs = self._regs.get(address)
+        if regs is None:
+            regs = self._regs[address] = list(self._model.power_on)
+        return regs
+
+    def _copy(self, event_ss, event_es, events, start: int, end: int):
+        """Append chunk events `start` to `end` as they are, `events` is None when they are not kept."""
+        if events is None:
+            return
+        result = self.result
+        result.event_ss.extend(event_ss[start:end])
+        result.event_es.extend(event_es[start:end])
+        result.event_data.extend(events[start:end])
+
+    def _put_event(self, ss, es, data):
+        if not self._events:
+            return
+        result = self.result
+        result.event_ss.append(ss)
+        result.event_es.append(es)
+        result.event_data.append(data)
+
+
+def decode_parallel(
+    source: Union[str, Iterable[Packet]],
+    options: Optional[Dict[str, object]] = None,
+    workers: Optional[int] = None,
+    chunk_packets: int = 256 * 1024,
+    forwarded: bool = False,
+) -> BatchResult:
+    """
+    decode_packets() spread over `workers` processes (default: one per CPU).
+    `source` is the path of a packet file, which every worker reads its
+    chunks from, or an iterable of packets, consumed lazily and handed to
+    the workers. At most two chunks per worker are in flight. The forwarded
+    i2c packets (py_ss, py_es, py_data) are only collected with `forwarded`.
+    """
+    # Not imported at module level, multiprocessing alone doubles the import time of this module.
+    from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+
+    if isinstance(source, str):
+        chunks = -(-_record_count(source) // chunk_packets)
+        jobs = ((_decode_file_chunk, source, index, chunk_packets, options, forwarded) for index in range(chunks))
+    else:
+        jobs = ((_decode_chunk, chunk, options, forwarded) for chunk in _split_at_stops(source, chunk_packets))
+
+    workers = workers or os.cpu_count() or 1
+    opts = default_options()
+    opts.update(options or {})
+    stitcher = _Stitcher(BatchResult(), device_model(options), events=opts["events"] == "yes")
+    with ProcessPoolExecutor(workers) as pool:
+        in_flight = deque()
+        for job in jobs:
+            in_flight.append(pool.submit(*job))
+            if len(in_flight) >= 2 * workers:
+                stitcher.add(*in_flight.popleft().result())
+        while in_flight:
+            stitcher.add(*in_flight.popleft().result())
+    return stitcher.result
+
+
+def decode_file(path: str, options: Optional[Dict[str, object]] = None) -> BatchResult:
+    return decode_packets(read_packets(path), options)
+
+
+def write_packets(path: str, packets: Iterable[Packet]) -> int:
+    """Write packets to a packet file, returns the number of records written. 'BITS' packets are skipped."""
+    count = 0
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(PACKET_FILE_MAGIC, PACKET_FILE_VERSION))
+        for record in _encode_records(packets):
+            f.write(record)
+            count += 1
+    return count
+
+
+def _encode_records(packets: Iterable[Packet]) -> Iterator[bytes]:
+    """Packet file records of `packets`, what follows the header of a packet file."""
+    pack = _RECORD.pack
+    codes = _FILE_CODES
+    for ss, es, (cmd, value) in packets:
+        code = codes.get(cmd)
+        if code is not None:
+            yield pack(ss, es, code, -1 if value is None else value)
+
+
+def read_packets(path: str) -> Iterator[Packet]:
+    with open(path, "rb") as f:
+        yield from _iter_records(f)
+
+
+def _read_header(f: BinaryIO):
+    magic, version = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != PACKET_FILE_MAGIC or version != PACKET_FILE_VERSION:
+        raise Exception(f"Not a PCA9534 packet file (magic {magic!r}, version {version})")
+
+
+def _record_count(path: str) -> int:
+    with open(path, "rb") as f:
+        _read_header(f)
+        size = os.fstat(f.fileno()).st_size - _HEADER.size
+    if size % _RECORD.size:
+        raise Exception(f"Truncated packet file, {size % _RECORD.size} trailing bytes")
+    return size // _RECORD.size
+
+
+def _unpack_records(f: BinaryIO) -> Iterator[Tuple[int, int, int, int]]:
+    """(ss, es, cmd code, value) of the records from the position of `f` on."""
+    iter_unpack = _RECORD.iter_unpack
+    tail = b""
+    while chunk := f.read(_READ_CHUNK):
+        if tail:
+            chunk = tail + chunk
+        usable = len(chunk) - len(chunk) % _RECORD.size
+        tail = chunk[usable:]
+        yield from iter_unpack(memoryview(chunk)[:usable])
+
+    if tail:
+        raise Exception(f"Truncated packet file, {len(tail)} trailing bytes")
+
+
+def _iter_records(f: BinaryIO) -> Iterator[Packet]:
+    _read_header(f)
+    commands = FILE_COMMANDS
+    for ss, es, code, value in _unpack_records(f):
+        yield ss, es, [commands[code], None if value < 0 else value]
@@ -0,0 +1,379 @@
+"""
+Throughput benchmarks for the PCA9534 decoder.
+
+Synthetic i2c packet streams, shaped like the output of the i2c decoder,
+are fed through Decoder.decode hosted by the batch stand-in with a sink
+that discards everything. Reports packets/second, per-transaction latency
+and peak memory per scenario.
+
+--startup instead measures what a batch runner decoding many short captures
+pays per capture: importing the decoder plus decoding a first transaction
+in a fresh interpreter, and creating a decoder plus decoding a first
+transaction in a warm one. Exits non-zero when either is over its budget.
+
+--parallel compares decode_parallel() with a sequential decode of the same
+packet file, once with the workers reading the file and once with the
+packets handed to them and the forwarded packets collected. Besides the wall
+clock speedup it reports the time the parent process spends receiving and
+stitching the chunk results, which bounds the speedup however many CPUs
+there are.
+
+    python -m i2c_pca9534.bench [--transactions N] [--scenario NAME ...] [--startup] [--parallel [--workers N]] [--json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import pickle
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import batch
+from .batch import Packet, create_decoder
+from .pd import ACK, ADDR_READ, ADDR_WRITE, CONFIG_REG, DATA_READ, DATA_WRITE, INPUT_REG, NACK, OUTPUT_REG, RESTART, START, STOP
+
+BYTE_SAMPLES = 90  # 9 clocks at 10 samples per bit
+EDGE_SAMPLES = 10
+
+
+class _Bus:
+    """Builds packets with consecutive sample numbers, optionally preceding every byte with its 'BITS'."""
+
+    def __init__(self, bits: bool = False):
+        self.sample = 0
+        self.bits = bits
+
+    def condition(self, cmd) -> Packet:
+        ss = self.sample
+        self.sample += EDGE_SAMPLES
+        return ss, self.sample - 1, [cmd, None]
+
+    def byte(self, cmd, value) -> Iterator[Packet]:
+        ss = self.sample
+        es = ss + BYTE_SAMPLES - EDGE_SAMPLES - 1
+        if self.bits:
+            step = (es - ss) // 8
+            yield ss, es, ["BITS", [[(value >> i) & 1, ss + (7 - i) * step, ss + (8 - i) * step] for i in range(8)]]
+        yield ss, es, [cmd, value]
+        self.sample = es + 1
+        yield self.condition(ACK if cmd != DATA_READ else NACK)
+
+    def pointer_write(self, address, reg) -> Iterator[Packet]:
+        yield self.condition(START)
+        yield from self.byte(ADDR_WRITE, address)
+        yield from self.byte(DATA_WRITE, reg)
+        yield self.condition(STOP)
+
+    def register_write(self, address, reg, value) -> Iterator[Packet]:
+        yield self.condition(START)
+        yield from self.byte(ADDR_WRITE, address)
+        yield from self.byte(DATA_WRITE, reg)
+        yield from self.byte(DATA_WRITE, value)
+        yield self.condition(STOP)
+
+    def restart_read(self, address, reg, value) -> Iterator[Packet]:
+        yield self.condition(START)
+        yield from self.byte(ADDR_WRITE, address)
+        yield from self.byte(DATA_WRITE, reg)
+        yield self.condition(RESTART)
+        yield from self.byte(ADDR_READ, address)
+        yield from self.byte(DATA_READ, value)
+        yield self.condition(STOP)
+
+    def read(self, address, value) -> Iterator[Packet]:
+        yield self.condition(START)
+        yield from self.byte(ADDR_READ, address)
+        yield from self.byte(DATA_READ, value)
+        yield self.condition(STOP)
+
+
+def pointer_writes(n: int, address: int = 0x20, bits: bool = False, seed: int = 0) -> Iterator[Packet]:
+    rnd = random.Random(seed)
+    bus = _Bus(bits)
+    for _ in range(n):
+        yield from bus.pointer_write(address, rnd.randrange(CONFIG_REG + 1))
+
+
+def register_writes(n: int, address: int = 0x20, bits: bool = False, seed: int = 0) -> Iterator[Packet]:
+    rnd = random.Random(seed)
+    bus = _Bus(bits)
+    for _ in range(n):
+        yield from bus.register_write(address, rnd.randrange(OUTPUT_REG, CONFIG_REG + 1), rnd.randrange(256))
+
+
+def restart_reads(n: int, address: int = 0x20, bits: bool = False, seed: int = 0) -> Iterator[Packet]:
+    rnd = random.Random(seed)
+    bus = _Bus(bits)
+    for _ in range(n):
+        yield from bus.restart_read(address, INPUT_REG, rnd.randrange(256))
+
+
+def nack_reads(n: int, address: int = 0x20, bits: bool = False, seed: int = 0) -> Iterator[Packet]:
+    """Input register polling: NACK-terminated reads relying on the sticky register pointer."""
+    rnd = random.Random(seed)
+    bus = _Bus(bits)
+    yield from bus.pointer_write(address, INPUT_REG)
+    for _ in range(n - 1):
+        yield from bus.read(address, rnd.randrange(256))
+
+
+def mixed(
+    n: int, addresses=(0x20,), foreign=(0x50, 0x51, 0x68), foreign_ratio: float = 0.0, bits: bool = False, seed: int = 0
+) -> Iterator[Packet]:
+    """
+    All transaction shapes for devices at `addresses`, with a `foreign_ratio`
+    share of register writes to the `foreign` slaves interleaved.
+    """
+    rnd = random.Random(seed)
+    bus = _Bus(bits)
+    for _ in range(n):
+        if rnd.random() < foreign_ratio:
+            yield from bus.register_write(rnd.choice(foreign), rnd.randrange(256), rnd.randrange(256))
+            continue
+        address = rnd.choice(addresses)
+        shape = rnd.randrange(4)
+        if shape == 0:
+            yield from bus.pointer_write(address, rnd.randrange(CONFIG_REG + 1))
+        elif shape == 1:
+            yield from bus.register_write(address, rnd.randrange(OUTPUT_REG, CONFIG_REG + 1), rnd.randrange(256))
+        elif shape == 2:
+            yield from bus.restart_read(address, INPUT_REG, rnd.randrange(256))
+        else:
+            yield from bus.read(address, rnd.randrange(256))
+
+
+# name: (traffic generator taking the transaction count, decoder options)
+SCENARIOS: Dict[str, Tuple[Callable[[int], Iterator[Packet]], Dict[str, object]]] = {
+    "pointer-writes": (pointer_writes, {}),
+    "register-writes": (register_writes, {}),
+    "restart-reads": (restart_reads, {}),
+    "nack-reads": (nack_reads, {}),
+    "mixed": (mixed, {}),
+    "foreign-95pct": (lambda n: mixed(n, foreign_ratio=0.95), {}),
+    "foreign-95pct-drop": (lambda n: mixed(n, foreign_ratio=0.95), {"other_traffic": "drop"}),
+    "bits-heavy": (lambda n: mixed(n, bits=True), {}),
+    "eight-devices": (lambda n: mixed(n, addresses=tuple(range(0x20, 0x28))), {"addresses": "0x20-0x27"}),
+    "headless": (mixed, {"annotations": "no"}),
+}
+
+
+def _discard(output_id, ss, es, data):
+    pass
+
+
+def _transaction_ends(packets: List[Packet]) -> List[int]:
+    return [i + 1 for i, (_, _, data) in enumerate(packets) if data[0] == STOP]
+
+
+def run_scenario(name: str, transactions: int, options: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+    generate, scenario_options = SCENARIOS[name]
+    opts = dict(scenario_options, **(options or {}))
+    packets = list(generate(transactions))
+
+    # Throughput, no instrumentation inside the loop.
+    decode = create_decoder(None, opts, _discard).decode
+    gc.collect()
+    t0 = time.perf_counter()
+    for ss, es, data in packets:
+        decode(ss, es, data)
+    elapsed = time.perf_counter() - t0
+
+    # Latency of every transaction, START up to its STOP.
+    decode = create_decoder(None, opts, _discard).decode
+    latencies = []
+    begin = 0
+    clock = time.perf_counter_ns
+    for end in _transaction_ends(packets):
+        t = clock()
+        for ss, es, data in packets[begin:end]:
+            decode(ss, es, data)
+        latencies.append(clock() - t)
+        begin = end
+    latencies.sort()
+
+    # Peak memory allocated by the decoder itself, the packet list already exists.
+    decode = create_decoder(None, opts, _discard).decode
+    tracemalloc.start()
+    for ss, es, data in packets:
+        decode(ss, es, data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "transactions": len(latencies),
+        "packets": len(packets),
+        "seconds": elapsed,
+        "packets_per_second": len(packets) / elapsed if elapsed else 0.0,
+        "latency_mean_us": sum(latencies) / len(latencies) / 1000 if latencies else 0.0,
+        "latency_p99_us": latencies[int(len(latencies) * 0.99)] / 1000 if latencies else 0.0,
+        "peak_memory_kib": peak / 1024,
+    }
+
+
+STARTUP_BUDGET_MS = 25.0  # Fresh interpreter, import plus first transaction
+SETUP_BUDGET_US = 50.0  # Warm interpreter, new decoder plus first transaction
+
+_STARTUP_SCRIPT = """
+import time
+t0 = time.perf_counter()
+from i2c_pca9534.batch import create_decoder
+t1 = time.perf_counter()
+decode = create_decoder(None, None, lambda *args: None).decode
+for ss, es, data in %r:
+    decode(ss, es, data)
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t1)
+"""
+
+
+def run_startup(repeat: int = 7, setups: int = 1000) -> Dict[str, object]:
+    packets = list(register_writes(1))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(__file__)), os.environ.get("PYTHONPATH")])))
+    imports = []
+    firsts = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT % (packets, )], env=env, check=True, capture_output=True, text=True).stdout
+        import_s, first_s = map(float, out.split())
+        imports.append(import_s)
+        firsts.append(first_s)
+
+    t0 = time.perf_counter()
+    for _ in range(setups):
+        decode = create_decoder(None, None, _discard).decode
+        for ss, es, data in packets:
+            decode(ss, es, data)
+    setup_us = (time.perf_counter() - t0) / setups * 1e6
+
+    startup_ms = statistics.median(i + f for i, f in zip(imports, firsts)) * 1000
+    return {
+        "import_ms": statistics.median(imports) * 1000,
+        "first_transaction_ms": statistics.median(firsts) * 1000,
+        "startup_ms": startup_ms,
+        "startup_budget_ms": STARTUP_BUDGET_MS,
+        "setup_us": setup_us,
+        "setup_budget_us": SETUP_BUDGET_US,
+        "within_budget": startup_ms <= STARTUP_BUDGET_MS and setup_us <= SETUP_BUDGET_US,
+    }
+
+
+PARALLEL_CHUNK_PACKETS = 64 * 1024
+
+
+def _parent_seconds(jobs, options: Optional[Dict[str, object]]) -> float:
+    """
+    Time the parent of decode_parallel() spends on `jobs`: pickling what is
+    sent, unpickling what comes back and stitching. The workers' part runs
+    beforehand, in this process.
+    """
+    sent = 0.0
+    results = []
+    for job, *args in jobs:
+        t0 = time.perf_counter()
+        pickle.dumps(args)
+        sent += time.perf_counter() - t0
+        results.append(pickle.dumps(job(*args)))
+    stitcher = batch._Stitcher(batch.BatchResult(), batch.device_model(options))  # pylint: disable=protected-access
+    t0 = time.perf_counter()
+    for result in results:
+        stitcher.add(*pickle.loads(result))
+    return sent + time.perf_counter() - t0
+
+
+def run_parallel(transactions: int, workers: Optional[int] = None, chunk_packets: int = PARALLEL_CHUNK_PACKETS) -> List[Dict[str, object]]:
+    # pylint: disable=protected-access
+    options = {"addresses": "0x20,0x21"}
+    packets = list(mixed(transactions, addresses=(0x20, 0x21), foreign_ratio=0.2))
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.bin")
+        batch.write_packets(path, packets)
+        chunks = -(-len(packets) // chunk_packets)
+        sources = (
+            ("file", path, False, [(batch._decode_file_chunk, path, i, chunk_packets, options, False) for i in range(chunks)]),
+            ("packets", packets, True, [(batch._decode_chunk, c, options, True) for c in batch._split_at_stops(packets, chunk_packets)]),
+        )
+        results = []
+        for name, source, forwarded, jobs in sources:
+            gc.collect()
+            t0 = time.perf_counter()
+            if name == "file":
+                batch.decode_file(path, options)
+            else:
+                batch.decode_packets(packets, options)
+            sequential = time.perf_counter() - t0
+            gc.collect()
+            t0 = time.perf_counter()
+            batch.decode_parallel(source, options, workers, chunk_packets, forwarded)
+            parallel = time.perf_counter() - t0
+            gc.collect()
+            parent = _parent_seconds(jobs, options)
+            results.append({
+                "source": name,
+                "forwarded": forwarded,
+                "packets": len(packets),
+                "workers": workers,
+                "sequential_seconds": sequential,
+                "parallel_seconds": parallel,
+                "parent_seconds": parent,
+                "speedup": sequential / parallel if parallel else 0.0,
+                "speedup_ceiling": sequential / parent if parent else 0.0,
+            })
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", "-n", type=int, default=20000, help="Transactions per scenario")
+    parser.add_argument("--scenario", "-s", action="append", choices=sorted(SCENARIOS), help="Scenario to run, repeatable (default: all)")
+    parser.add_argument("--startup", action="store_true", help="Measure import and decoder setup cost instead")
+    parser.add_argument("--parallel", action="store_true", help="Measure decode_parallel() against a sequential decode instead")
+    parser.add_argument("--workers", type=int, help="Worker processes for --parallel (default: one per CPU)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        r = run_startup()
+        if args.json:
+            print(json.dumps(r, indent=2))
+        else:
+            print(f"import {r['import_ms']:.1f} ms + first transaction {r['first_transaction_ms']:.2f} ms = "
+                  f"{r['startup_ms']:.1f} ms (budget {r['startup_budget_ms']:.0f} ms)")
+            print(f"new decoder + first transaction {r['setup_us']:.1f} us (budget {r['setup_budget_us']:.0f} us)")
+        sys.exit(0 if r["within_budget"] else 1)
+
+    if args.parallel:
+        results = run_parallel(args.transactions, args.workers)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{'source':<8} {'forwarded':>9} {'packets':>9} {'workers':>7} {'seq s':>7} {'par s':>7} {'parent s':>8} {'speedup':>7} {'ceiling':>7}")
+        for r in results:
+            print(
+                f"{r['source']:<8} {'yes' if r['forwarded'] else 'no':>9} {r['packets']:>9} {r['workers']:>7} {r['sequential_seconds']:>7.2f} "
+                f"{r['parallel_seconds']:>7.2f} {r['parent_seconds']:>8.2f} {r['speedup']:>6.1f}x {r['speedup_ceiling']:>6.1f}x"
+            )
+        return
+
+    results = [run_scenario(name, args.transactions) for name in (args.scenario or SCENARIOS)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'scenario':<20} {'packets':>9} {'packets/s':>12} {'mean us':>9} {'p99 us':>9} {'peak KiB':>9}")
+    for r in results:
+        print(
+            f"{r['scenario']:<20} {r['packets']:>9} {r['packets_per_second']:>12,.0f} "
+            f"{r['latency_mean_us']:>9.1f} {r['latency_p99_us']:>9.1f} {r['peak_memory_kib']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
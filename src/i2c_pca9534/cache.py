@@ -0,0 +1,204 @@
+"""
+Content addressed cache of decoded transaction tables.
+
+Decoding the same capture with the same options always gives the same
+transactions, so the columnar table written by export_transactions() is
+kept on disk under a key hashed from:
+
+    the decoder source and the table layout
+    the options that change the table, normalized
+    the packet file records of the input ('BITS' do not matter)
+
+A repeat decode is a lookup plus memory mapping the columns. Packet files
+and in-memory packet sequences hash the same, the header of a file is not
+part of the key.
+
+Several processes may share one cache directory. Entries are written to a
+private temporary directory and renamed into place, a reader either finds a
+complete entry or none. Eviction of the least recently used entries, once
+the cache grows past `max_bytes`, runs under an exclusive flock(); readers
+hold a shared one while they map an entry. Without fcntl (Windows) there is
+no locking and an entry still mapped by another process is left for the
+next eviction.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, Iterable, Optional, Sequence, Union
+
+from . import batch, export, pd
+from .batch import _HEADER, Packet, _encode_records, default_options, read_packets
+from .export import export_transactions, load_transactions
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Bump when the meaning of a cached table changes without pd.py, batch.py or export.py changing.
+CACHE_FORMAT_VERSION = 1
+
+_LOCK_FILE = ".lock"
+_TMP_PREFIX = ".tmp-"
+_STALE_TMP_SECONDS = 24 * 60 * 60  # Left behind by a worker that died while decoding
+_HASH_CHUNK = 1024 * 1024
+
+_fingerprint: Optional[bytes] = None
+
+
+def _decoder_fingerprint() -> bytes:
+    """Digest of the code that produces a table, any edit invalidates the cache."""
+    global _fingerprint
+    if _fingerprint is None:
+        h = hashlib.sha256(f"{CACHE_FORMAT_VERSION}".encode())
+        for module in (pd, batch, export):
+            with open(module.__file__, "rb") as f:
+                h.update(f.read())
+        _fingerprint = h.digest()
+    return _fingerprint
+
+
+def _key_options(options: Optional[Dict[str, object]]) -> Dict[str, object]:
+    """
+    The options a transaction table depends on, with defaults filled in and
+    normalized so that equal decodes hash the same however they are spelled
+    (32 or "32", 'address' or a one address 'addresses'). Annotation,
+    diagnostics, forwarding and streaming options leave the table alone.
+    """
+    opts = default_options()
+    opts.update(options or {})
+    addresses = pd.parse_addresses(str(opts["addresses"])) or [int(opts["address"]) or pd.I2C_BUS_ADDR]
+    return {
+        "addresses": sorted(set(addresses)),
+        "device": pd.device_model(opts).name,
+        "max_packets": max(int(opts["max_packets"]), 0),
+        "events": str(opts["events"]),
+    }
+
+
+class _Lock:
+    """flock() on the cache lock file, a no-op without fcntl."""
+
+    def __init__(self, directory: str, exclusive: bool):
+        self._path = os.path.join(directory, _LOCK_FILE)
+        self._mode = 0 if fcntl is None else fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        self._fd = -1
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, self._mode)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd >= 0:
+            os.close(self._fd)  # Releases the lock
+            self._fd = -1
+
+
+class DecodeCache:
+    """Decoded transaction tables in `directory`, at most about `max_bytes` of them."""
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source: Union[str, Sequence[Packet]], options: Optional[Dict[str, object]] = None) -> str:
+        """Cache key of a packet file path or a packet sequence decoded with `options`."""
+        h = hashlib.sha256(_decoder_fingerprint())
+        h.update(json.dumps(_key_options(options), sort_keys=True).encode())
+        h.update(b"\0")
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                f.seek(_HEADER.size)
+                while chunk := f.read(_HASH_CHUNK):
+                    h.update(chunk)
+        else:
+            for record in _encode_records(source):
+                h.update(record)
+        return h.hexdigest()
+
+    def transactions(self, source: Union[str, Sequence[Packet]], options: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+        """
+        The export_transactions() table of `source`, a packet file path or
+        a packet sequence (it is read twice on a miss), as memory mapped
+        numpy arrays by column name. Decoded only when not cached yet.
+        """
+        key = self.key(source, options)
+        path = os.path.join(self.directory, key)
+        columns = self._load(path)
+        if columns is not None:
+            self.hits += 1
+            return columns
+
+        self.misses += 1
+        packets: Iterable[Packet] = read_packets(source) if isinstance(source, str) else source
+        tmp = tempfile.mkdtemp(prefix=_TMP_PREFIX, dir=self.directory)
+        try:
+            export_transactions(packets, tmp, options)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another worker stored the same entry first, theirs is as good as ours.
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict(keep=key)
+        columns = self._load(path)
+        if columns is None:
+            raise Exception(f"Decode cache entry {key} vanished, max_bytes {self.max_bytes} is too small")
+        return columns
+
+    def _load(self, path: str) -> Optional[Dict[str, object]]:
+        with _Lock(self.directory, exclusive=False):
+            if not os.path.isdir(path):
+                return None
+            os.utime(path)  # Recently used
+            return load_transactions(path, mmap=True)
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        """(path, last use, bytes) of every complete entry."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            entries.append((entry.path, entry.stat().st_mtime, size))
+        return entries
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove the least recently used entries until the cache fits `max_bytes`, `keep` is never removed."""
+        with _Lock(self.directory, exclusive=True):
+            now = time.time()
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(_TMP_PREFIX) and now - entry.stat().st_mtime > _STALE_TMP_SECONDS:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            total = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if os.path.basename(path) == keep:
+                    continue
+                # Renamed first so a reader never sees a half deleted entry.
+                trash = tempfile.mkdtemp(prefix=_TMP_PREFIX, dir=self.directory)
+                try:
+                    os.rename(path, os.path.join(trash, "entry"))
+                except OSError:
+                    continue  # Still mapped somewhere, on Windows
+                finally:
+                    shutil.rmtree(trash, ignore_errors=True)
+                total -= size
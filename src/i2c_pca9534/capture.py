@@ -0,0 +1,238 @@
+"""
+Decoding of recorded logic captures too large to load into memory.
+
+A capture, a sigrok session file (.sr) or a raw logic dump, is read in
+chunks of samples straight from a memory map of the file. Only SCL and SDA
+matter, every chunk is reduced to the samples where one of them changes and
+the sigrok i2c decoder is fed from those through a stand-in for the
+libsigrokdecode input, so idle bus time costs numpy time only. The i2c
+packets go into the PCA9534 decoder as they are produced, nothing but the
+transitions of the current chunk is held in memory.
+
+Session file members are memory mapped when stored uncompressed and
+decompressed chunk by chunk otherwise.
+
+    from i2c_pca9534 import capture
+
+    result = capture.decode_capture("capture.sr", {"address": 0x20})
+
+Requires numpy and the pysigrok i2c decoder.
+"""
+
+import configparser
+import re
+import struct
+import zipfile
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import sigrokdecode as srd
+
+from .batch import BatchResult, Sink, create_decoder
+
+CHUNK_SAMPLES = 4 * 1024 * 1024
+
+_UNITS = {"Hz": 1, "kHz": 1000, "KHz": 1000, "MHz": 1000000, "GHz": 1000000000}
+_LOCAL_HEADER = struct.Struct("<4s22xHH")  # Zip local file header up to the name and extra field lengths
+_LOGIC_MEMBER = re.compile(r"logic-1(?:-(\d+))?$")
+
+
+def _sample_dtype(unitsize: int) -> np.dtype:
+    if unitsize not in (1, 2, 4, 8):
+        raise Exception(f"Unsupported unit size {unitsize}")
+    return np.dtype(f"<u{unitsize}")
+
+
+def _parse_samplerate(text: str) -> int:
+    m = re.fullmatch(r"\s*([\d.]+)\s*([kKMG]?Hz)?\s*", text)
+    if m is None:
+        raise Exception(f"Unknown samplerate {text!r}")
+    return int(float(m.group(1)) * _UNITS[m.group(2) or "Hz"])
+
+
+class SessionFile:
+    """
+    A sigrok session file. `channels` are the logic channel names by bit
+    number within a sample.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with zipfile.ZipFile(path) as zf:
+            metadata = configparser.ConfigParser()
+            metadata.read_string(zf.read("metadata").decode("ascii"))
+            self._members = sorted(
+                (int(m.group(1) or 0), info) for info in zf.infolist() if (m := _LOGIC_MEMBER.match(info.filename))
+            )
+        device = metadata["device 1"]
+        self.samplerate = _parse_samplerate(device.get("samplerate", "0"))
+        self.unitsize = int(device["unitsize"])
+        self.dtype = _sample_dtype(self.unitsize)
+        self.channels: Dict[int, str] = {
+            bit: device[f"probe{bit + 1}"] for bit in range(int(device.get("total probes", "0"))) if f"probe{bit + 1}" in device
+        }
+
+    def chunks(self, samples: int = CHUNK_SAMPLES) -> Iterator[np.ndarray]:
+        with open(self.path, "rb") as f, zipfile.ZipFile(f) as zf:
+            for _, info in self._members:
+                if info.compress_type == zipfile.ZIP_STORED:
+                    f.seek(info.header_offset)
+                    magic, name_len, extra_len = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+                    if magic != b"PK\x03\x04":
+                        raise Exception(f"Bad zip member {info.filename}")
+                    offset = info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+                    data = np.memmap(self.path, dtype=self.dtype, mode="r", offset=offset, shape=(info.file_size // self.unitsize,))
+                    for begin in range(0, len(data), samples):
+                        yield data[begin:begin + samples]
+                else:
+                    with zf.open(info) as member:
+                        while block := member.read(samples * self.unitsize):
+                            yield np.frombuffer(block, dtype=self.dtype)
+
+
+class RawLogic:
+    """A raw logic dump, `unitsize` bytes per sample, bit N is channel N."""
+
+    def __init__(self, path: str, unitsize: int = 1, samplerate: int = 0, channels: Optional[Dict[int, str]] = None):
+        self.path = path
+        self.samplerate = samplerate
+        self.unitsize = unitsize
+        self.dtype = _sample_dtype(unitsize)
+        self.channels = channels or {}
+
+    def chunks(self, samples: int = CHUNK_SAMPLES) -> Iterator[np.ndarray]:
+        data = np.memmap(self.path, dtype=self.dtype, mode="r")
+        for begin in range(0, len(data), samples):
+            yield data[begin:begin + samples]
+
+
+Source = Union[SessionFile, RawLogic]
+
+
+def _channel_bit(source: Source, channel: Union[int, str]) -> int:
+    if isinstance(channel, int):
+        return channel
+    for bit, name in source.channels.items():
+        if name.lower() == channel.lower():
+            return bit
+    raise Exception(f"No channel {channel!r} in capture, channels are {', '.join(source.channels.values())}")
+
+
+class _EdgeInput:
+    """
+    Stands in for the input of a libsigrokdecode decoder stack, serving
+    SCL (channel 0) and SDA (channel 1) of a chunked capture. wait() only
+    visits the samples where a line changes: in between an edge condition
+    cannot match and a level condition matches at the first sample already.
+    """
+
+    def __init__(self, chunks: Iterator[np.ndarray], scl: int, sda: int):
+        self.samplenum = -1
+        self.matched: List[bool] = []
+        self._chunks = chunks
+        self._scl = scl
+        self._sda = sda
+        self._value = 0  # Lines at samplenum, SCL in bit 0 and SDA in bit 1
+        self._last = -1  # Lines at the last sample read
+        self._edges = np.zeros(0, dtype=np.int64)
+        self._levels = np.zeros(0, dtype=np.uint8)
+        self._next = 0
+        self._end = 0  # Samples read so far
+
+    def _next_edge(self) -> int:
+        """Sample of the next line change, the end of the capture when there is none."""
+        while self._next >= len(self._edges):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return self._end
+            lines = ((chunk >> self._scl) & 1 | ((chunk >> self._sda) & 1) << 1).astype(np.uint8)
+            if not len(lines):
+                continue
+            if self._last < 0:
+                self._last = self._value = int(lines[0])
+            previous = np.empty_like(lines)
+            previous[0] = self._last
+            previous[1:] = lines[:-1]
+            changed = np.flatnonzero(lines != previous)
+            self._edges = changed + self._end
+            self._levels = lines[changed]
+            self._next = 0
+            self._last = int(lines[-1])
+            self._end += len(lines)
+        return int(self._edges[self._next])
+
+    def wait(self, conds: List[Dict[Union[int, str], object]]) -> Tuple[int, int]:
+        sample = self.samplenum + 1
+        skips = [self.samplenum + c["skip"] if "skip" in c else -1 for c in conds]
+        while True:
+            edge = self._next_edge()
+            if sample < edge:
+                # Lines unchanged up to the edge, only levels and skips can match.
+                matched = self._match(conds, skips, sample, self._value) if conds else [True]
+                if any(matched):
+                    return self._matched(sample, matched)
+                sample = min([edge] + [s for s in skips if s > sample])
+                continue
+            if sample >= self._end:
+                raise EOFError()
+            last = self._value
+            self._value = int(self._levels[self._next])
+            self._next += 1
+            matched = self._match(conds, skips, sample, last) if conds else [True]
+            if any(matched):
+                return self._matched(sample, matched)
+            sample += 1
+
+    def _match(self, conds, skips: List[int], sample: int, last: int) -> List[bool]:
+        return [skip == sample if skip >= 0 else srd.cond_matches(c, last, self._value) for c, skip in zip(conds, skips)]
+
+    def _matched(self, sample: int, matched: List[bool]) -> Tuple[int, int]:
+        self.samplenum = sample
+        self.matched = matched
+        return self._value & 1, self._value >> 1
+
+
+def _i2c_decoder_class():
+    # srd.get_decoder() cannot index the entry points of Python 3.12+
+    from importlib.metadata import entry_points  # pylint: disable=import-outside-toplevel
+
+    for entry in entry_points(group="pysigrok.decoders", name="i2c"):
+        return entry.load()
+    raise Exception("The sigrok i2c decoder is not installed")
+
+
+def decode_capture(
+    source: Union[str, Source],
+    options: Optional[Dict[str, object]] = None,
+    sink: Optional[Sink] = None,
+    scl: Union[int, str] = "SCL",
+    sda: Union[int, str] = "SDA",
+    i2c_options: Optional[Dict[str, object]] = None,
+    chunk_samples: int = CHUNK_SAMPLES,
+) -> Optional[BatchResult]:
+    """
+    Decode the capture `source`, a SessionFile, a RawLogic or the path of a
+    session file. `scl` and `sda` are channel names or bit numbers. The
+    output is collected in a BatchResult, or passed to `sink` when one is
+    given.
+    """
+    if isinstance(source, str):
+        source = SessionFile(source)
+    result = None if sink is not None else BatchResult()
+    decoder = create_decoder(result, options, sink)
+
+    i2c_class = _i2c_decoder_class()
+    i2c = i2c_class()
+    i2c.options = {o["id"]: o["default"] for o in i2c_class.options}
+    i2c.options.update(i2c_options or {})
+    i2c.set_channelnum("scl", 0)
+    i2c.set_channelnum("sda", 1)
+    i2c.add_callback(srd.OUTPUT_PYTHON, None, decoder.decode)
+    i2c.reset()
+    if source.samplerate:
+        i2c.metadata(srd.SRD_CONF_SAMPLERATE, source.samplerate)
+    i2c.start()
+    i2c.run(_EdgeInput(source.chunks(chunk_samples), _channel_bit(source, scl), _channel_bit(source, sda)))
+    i2c.stop()
+    decoder.flush()
+    return result
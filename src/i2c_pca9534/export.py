@@ -0,0 +1,160 @@
+"""
+Columnar export of decoded PCA9534 transactions.
+
+Every 'TRANSACTION' event of the decoder becomes one row. Each column is
+written to its own .npy file in the export directory, which
+`numpy.load(path, mmap_mode="r")` maps without reading it. Rows are buffered
+in fixed size chunks and appended to the files as they fill, so memory stays
+flat however long the capture is. Writing needs nothing beyond the standard
+library, numpy is only imported by load_transactions().
+
+Columns:
+    ss, es      uint64  sample range, slave address up to the last ACK/NACK
+    address     uint8   7-bit slave address
+    direction   uint8   DIRECTION_WRITE or DIRECTION_READ
+    register    int16   register number, -1 when not known
+    value       int32   data byte, -1 for a register pointer write
+    ack         uint8   1 when the last byte was ACKed, 0 for NACK
+"""
+
+import array
+import os
+import struct
+import sys
+from typing import Dict, Iterable, Optional
+
+from .batch import OUT_EVENTS, Packet, create_decoder
+from .pd import DIR_READ, TRANSACTION
+
+DIRECTION_WRITE = 0
+DIRECTION_READ = 1
+
+# (column, array typecode, numpy type without byte order)
+COLUMNS = (
+    ("ss", "Q", "u8"),
+    ("es", "Q", "u8"),
+    ("address", "B", "u1"),
+    ("direction", "B", "u1"),
+    ("register", "h", "i2"),
+    ("value", "i", "i4"),
+    ("ack", "B", "u1"),
+)
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_SIZE = 128  # Fixed so the row count can be patched in place on close
+_BYTE_ORDER = "<" if sys.byteorder == "little" else ">"
+
+
+def _npy_header(npy_type: str, rows: int) -> bytes:
+    descr = ("|" if npy_type.endswith("1") else _BYTE_ORDER) + npy_type
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, rows)
+    header = header.ljust(_NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2 - 1) + "\n"
+    return _NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class TransactionWriter:
+    """
+    Streams transactions into one .npy file per column. Without a directory
+    the rows are kept in memory instead, see columns().
+    """
+
+    def __init__(self, directory: Optional[str] = None, chunk_rows: int = 64 * 1024):
+        self.directory = directory
+        self.rows = 0  # Rows written to the files
+        self._chunk_rows = chunk_rows if directory is not None else sys.maxsize
+        self._files = []
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for name, _, npy_type in COLUMNS:
+                f = open(os.path.join(directory, f"{name}.npy"), "wb")
+                f.write(_npy_header(npy_type, 0))
+                self._files.append(f)
+        self._new_chunks()
+
+    def __len__(self) -> int:
+        return self.rows + len(self._ss)
+
+    def _new_chunks(self):
+        (self._ss, self._es, self._address, self._direction,
+         self._register, self._value, self._ack) = self._chunks = [array.array(code) for _, code, _ in COLUMNS]
+
+    def append(self, ss, es, address, direction, register, value, ack):
+        self._ss.append(ss)
+        self._es.append(es)
+        self._address.append(address)
+        self._direction.append(direction)
+        self._register.append(register)
+        self._value.append(value)
+        self._ack.append(ack)
+        if len(self._ss) >= self._chunk_rows:
+            self.flush()
+
+    def add_event(self, ss, es, data):
+        """Append a 'pca9534' OUTPUT_PYTHON packet, anything but a TRANSACTION is ignored."""
+        if data[0] != TRANSACTION:
+            return
+        address, direction, register, value, ack = data[1]
+        self.append(
+            ss,
+            es,
+            address,
+            DIRECTION_READ if direction == DIR_READ else DIRECTION_WRITE,
+            -1 if register is None else register,
+            -1 if value is None else value,
+            1 if ack else 0,
+        )
+
+    def flush(self):
+        if not self._ss or not self._files:
+            return
+        self.rows += len(self._ss)
+        for f, chunk in zip(self._files, self._chunks):
+            chunk.tofile(f)
+        self._new_chunks()
+
+    def columns(self) -> Dict[str, array.array]:
+        """Column name to the rows of a writer without a directory."""
+        if self.directory is not None:
+            raise Exception(f"Rows are written to {self.directory}, load them with load_transactions()")
+        return {name: chunk for (name, _, _), chunk in zip(COLUMNS, self._chunks)}
+
+    def close(self):
+        self.flush()
+        for f, (_, _, npy_type) in zip(self._files, COLUMNS):
+            f.seek(0)
+            f.write(_npy_header(npy_type, self.rows))
+            f.close()
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_transactions(
+    packets: Iterable[Packet], directory: str, options: Optional[Dict[str, object]] = None, chunk_rows: int = 64 * 1024
+) -> int:
+    """Decode `packets` and write the transactions to `directory`, returns the number of rows."""
+    with TransactionWriter(directory, chunk_rows) as writer:
+        add_event = writer.add_event
+
+        def sink(output_id, ss, es, data):
+            if output_id == OUT_EVENTS:
+                add_event(ss, es, data)
+
+        decoder = create_decoder(None, options, sink)
+        decode = decoder.decode
+        for ss, es, data in packets:
+            decode(ss, es, data)
+        decoder.flush()
+    return writer.rows
+
+
+def load_transactions(directory: str, mmap: bool = True) -> Dict[str, object]:
+    """Column name to numpy array, memory mapped unless `mmap` is False."""
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    mode = "r" if mmap else None
+    return {name: numpy.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode) for name, _, _ in COLUMNS}
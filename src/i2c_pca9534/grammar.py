@@ -0,0 +1,291 @@
+"""
+Source of the PCA9534 transaction grammar.
+
+The grammar is written as nested dicts keyed by i2c command, a state may
+name the message builder that runs when it is entered. pd.py does not
+build it at import, it carries the compiled tables as literal tuples:
+
+    TRANSITIONS[state * N_COMMANDS + cmd_id]  next state
+    STATE_BUILDERS[state]                     builder of a terminal state
+    EARLY_BUILDERS[state]                     builder whose message is certain in that state
+    POINTER_SENT[state]                       a register pointer byte was written, see pointer_sent()
+    ERROR_STATE, RESYNC_STATE                 grammar violations, see mark_violations()
+
+After editing the grammar regenerate them with
+
+    python -m i2c_pca9534.grammar > tables.txt
+
+and paste the output over the tables in pd.py. verify() checks that the
+two agree, `make check-grammar` runs it.
+"""
+
+import sys
+from typing import List, Tuple
+
+from . import pd
+from .pd import (
+    ACK,
+    ADDR_READ,
+    ADDR_WRITE,
+    CMD_ADDR_WRITE,
+    CMD_DATA_WRITE,
+    CMD_RESTART,
+    CMD_START,
+    CMD_STOP,
+    COMMANDS,
+    DATA_READ,
+    DATA_WRITE,
+    N_COMMANDS,
+    NACK,
+    RESTART,
+    START,
+    STOP,
+    _COMMAND_IDS,
+)
+
+
+# Quick and dirty state table.
+_state_machine = {
+    START: {
+        ADDR_WRITE: {
+            ACK: {
+                DATA_WRITE: {
+                    ACK: {
+                        DATA_WRITE: {
+                            ACK: {
+                                STOP: {
+                                    # Write to X register value V
+                                    "build_gui_text": "msg_write_to_register",
+                                },
+                                RESTART: {
+                                    # Write to X register value V
+                                    "build_gui_text": "msg_write_to_register",
+                                    ADDR_WRITE: {},
+                                    ADDR_READ: {},
+                                }
+                            },
+                            NACK: {
+                                STOP: {
+                                    # Write to X register value V
+                                    "build_gui_text": "msg_write_to_register",
+                                },
+                            },
+                        },
+                        RESTART: {
+                            "build_gui_text": "msg_set_register_as_read_from",
+                            ADDR_WRITE: {},
+                            ADDR_READ: {},
+                        },
+                        STOP: {
+                            # Set X register as register to read from.
+                            "build_gui_text": "msg_set_register_as_read_from",
+                        }
+                    },
+                    NACK: {},
+                },
+                DATA_READ: {},
+            },
+            NACK: {},
+        },
+        ADDR_READ: {
+            ACK: {
+                DATA_READ: {
+                    ACK: {
+                        STOP: {
+                            # Read from X register
+                            "build_gui_text": "msg_read_from_register",
+                        },
+                        RESTART: {
+                            # Read from X register
+                            "build_gui_text": "msg_read_from_register",
+                            ADDR_WRITE: {},
+                            ADDR_READ: {},
+                        },
+                    },
+                    NACK: {
+                        STOP: {
+                            # Read from X register
+                            "build_gui_text": "msg_read_from_register",
+                        },
+                        RESTART: {
+                            # Read from X register
+                            "build_gui_text": "msg_read_from_register",
+                            ADDR_WRITE: {},
+                            ADDR_READ: {},
+                        },
+                    },
+                }
+            },
+            NACK: {}
+        }
+    },
+    RESTART: {},
+    STOP: {
+        "build_gui_text": "msg_noop",
+    },
+}
+
+_state_machine[RESTART] = _state_machine[START]
+_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_WRITE] = _state_machine[START][ADDR_WRITE]
+_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_READ] = _state_machine[START][ADDR_READ]
+_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_READ] = _state_machine[START][ADDR_READ]
+_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_WRITE] = _state_machine[START][ADDR_WRITE]
+_state_machine[START][ADDR_READ][ACK][DATA_READ][ACK][RESTART][ADDR_WRITE] = _state_machine[START][ADDR_WRITE]
+_state_machine[START][ADDR_READ][ACK][DATA_READ][ACK][RESTART][ADDR_READ] = _state_machine[START][ADDR_READ]
+_state_machine[START][ADDR_READ][ACK][DATA_READ][NACK][RESTART][ADDR_WRITE] = _state_machine[START][ADDR_WRITE]
+_state_machine[START][ADDR_READ][ACK][DATA_READ][NACK][RESTART][ADDR_READ] = _state_machine[START][ADDR_READ]
+_state_machine[START][ADDR_WRITE][NACK] = _state_machine[START][ADDR_WRITE][ACK]
+_state_machine[START][ADDR_READ][NACK] = _state_machine[START][ADDR_READ][ACK]
+
+
+def compile_grammar(root):
+    """
+    Flatten the nested state dict into integer state ids, aliased dicts
+    become a single state. Returns (transitions, builders) where
+    transitions[state * N_COMMANDS + cmd_id] is the next state and
+    builders[state] names the message builder of a terminal state.
+    Commands a state does not list leave the state unchanged.
+    """
+    ids = {id(root): 0}
+    states = [root]
+    i = 0
+    while i < len(states):
+        for key, nxt in states[i].items():
+            if key in _COMMAND_IDS and id(nxt) not in ids:
+                ids[id(nxt)] = len(states)
+                states.append(nxt)
+        i += 1
+
+    transitions = []
+    for state_id, state in enumerate(states):
+        row = [state_id] * N_COMMANDS
+        for key, nxt in state.items():
+            if key in _COMMAND_IDS:
+                row[_COMMAND_IDS[key]] = ids[id(nxt)]
+        transitions.extend(row)
+
+    return tuple(transitions), tuple(state.get("build_gui_text") for state in states)
+
+
+def early_builders(transitions, builders):
+    """
+    Builder per state for states whose message is already certain: every
+    transition out of them leads to a terminal state of that same builder.
+    """
+    early = []
+    for state in range(len(builders)):
+        targets = {transitions[state * N_COMMANDS + cmd] for cmd in range(N_COMMANDS)} - {state}
+        names = {builders[target] for target in targets}
+        early.append(names.pop() if len(names) == 1 and None not in names else None)
+    return tuple(early)
+
+
+def pointer_sent(transitions, builders):
+    """
+    Per state, whether the segment has written a register pointer byte to the
+    device while no message took it over yet. A grammar violation in such a
+    state leaves the pointer of the device unknown. Walks the segments that
+    start with a slave write address, stopping at conditions.
+    """
+    sent = [False] * len(builders)
+    conditions = (CMD_START, CMD_RESTART, CMD_STOP)
+    first = transitions[transitions[CMD_START] * N_COMMANDS + CMD_ADDR_WRITE]
+    todo = [(first, False)]
+    seen = set()
+    while todo:
+        state, written = todo.pop()
+        if (state, written) in seen:
+            continue
+        seen.add((state, written))
+        sent[state] = sent[state] or written
+        for cmd in range(N_COMMANDS):
+            nxt = transitions[state * N_COMMANDS + cmd]
+            if nxt != state and cmd not in conditions:
+                todo.append((nxt, written or cmd == CMD_DATA_WRITE))
+    return tuple(sent)
+
+
+def mark_violations(transitions, builders, early):
+    """
+    Turn commands a state does not list into grammar violations. Adds an
+    error state, entered on a command that cannot follow, which waits for
+    the next START or REPEATED START. A START or REPEATED START the state
+    does not list goes to RESYNC_STATE, a pseudo state the decoder resolves
+    by starting over at that condition. Left alone are the root state (a
+    capture may begin mid-transfer), states without successors, states whose
+    message is already certain (extra bytes are ignored) and a STOP. Returns
+    (transitions, builders, early, error_state, resync_state).
+    """
+    error = len(builders)
+    resync = error + 1
+    marked = list(transitions)
+    for state in range(1, len(builders)):
+        row = transitions[state * N_COMMANDS:(state + 1) * N_COMMANDS]
+        has_successors = any(nxt != state for nxt in row)
+        for cmd, nxt in enumerate(row):
+            if nxt != state:
+                continue
+            if cmd == CMD_START or cmd == CMD_RESTART:
+                marked[state * N_COMMANDS + cmd] = resync
+            elif has_successors and early[state] is None and cmd != CMD_STOP:
+                marked[state * N_COMMANDS + cmd] = error
+
+    error_row = [error] * N_COMMANDS
+    error_row[CMD_START] = transitions[CMD_START]
+    error_row[CMD_RESTART] = transitions[CMD_RESTART]
+    marked.extend(error_row)
+    return tuple(marked), builders + (None, ), early + (None, ), error, resync
+
+
+def compiled() -> Tuple[Tuple[int, ...], Tuple[str, ...], Tuple[str, ...], Tuple[bool, ...], int, int]:
+    """(TRANSITIONS, STATE_BUILDERS, EARLY_BUILDERS, POINTER_SENT, ERROR_STATE, RESYNC_STATE) compiled from the grammar source."""
+    transitions, builders = compile_grammar(_state_machine)
+    sent = pointer_sent(transitions, builders)
+    transitions, builders, early, error, resync = mark_violations(transitions, builders, early_builders(transitions, builders))
+    return transitions, builders, early, sent + (False, ), error, resync
+
+
+def format_tables() -> str:
+    """The compiled tables as the Python source pd.py carries."""
+    transitions, builders, early, sent, error, resync = compiled()
+    lines = [
+        "# Compiled from the grammar in grammar.py, regenerate with",
+        "# `python -m i2c_pca9534.grammar`. One row of next states per state,",
+        "# columns in COMMANDS order: " + ", ".join(COMMANDS) + ".",
+        "TRANSITIONS = (",
+    ]
+    for state, builder in enumerate(builders):
+        row = ", ".join(str(nxt) for nxt in transitions[state * N_COMMANDS:(state + 1) * N_COMMANDS])
+        name = " error" if state == error else f" {builder}" if builder else ""
+        lines.append(f"    {row},  # {state}{name}")
+    lines.append(")")
+    lines.append(f"ERROR_STATE = {error}")
+    lines.append(f"RESYNC_STATE = {resync}  # Not a row, see mark_violations() in grammar.py")
+    for name, table in (("STATE_BUILDERS", builders), ("EARLY_BUILDERS", early), ("POINTER_SENT", sent)):
+        lines.append(f"{name} = (")
+        lines.extend(f"    {builder!r},  # {state}" for state, builder in enumerate(table))
+        lines.append(")")
+    return "\n".join(lines)
+
+
+def verify() -> List[str]:
+    """Differences between the grammar source and the tables in pd.py, empty when they agree."""
+    errors = []
+    for name, table in zip(("TRANSITIONS", "STATE_BUILDERS", "EARLY_BUILDERS", "POINTER_SENT", "ERROR_STATE", "RESYNC_STATE"), compiled()):
+        if getattr(pd, name) != table:
+            errors.append(f"pd.{name} does not match the grammar, regenerate it with `python -m i2c_pca9534.grammar`")
+    return errors
+
+
+def main(argv: List[str]) -> int:
+    if argv[1:] == ["--verify"]:
+        errors = verify()
+        for error in errors:
+            print(error, file=sys.stderr)
+        return 1 if errors else 0
+    print(format_tables())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -41,6 +41,30 @@
 # stop positions, in LSB first order (although the I2C protocol is MSB first).
 # ============================================================================
 
+# ============================================================================
+# OUTPUT_PYTHON format of this decoder, proto 'pca9534', put only with the
+# 'events' option on. Decoders stacked on this one receive them mixed with the
+# forwarded i2c packets, the batch host (batch.py) keeps them apart.
+# Packet:
+# [<ptype>, <pdata>]
+
+# <ptype>:
+#  - 'TRANSACTION' (<pdata>: (address, direction, register, value, ack))
+#  - 'PIN CHANGE' (<pdata>: (address, register, pin, old, new))
+
+# One 'TRANSACTION' per decoded register access, ss/es span the slave
+# address up to the ACK/NACK of the byte. Parts that auto-increment the
+# register pointer get one per byte of a burst, each with its register.
+# <direction> is 'write' or 'read', <register> is the register number or
+# None when a read happens before any command byte was seen, <value> is None
+# for a transaction that only sets the register pointer, <ack> is False when
+# the byte was NACKed.
+# One 'PIN CHANGE' per pin whose bit changed in the decoder's shadow copy of
+# a device register, ss/es are those of the data byte that changed it.
+# <register> is the register number of the 8-bit port, <old> is None the
+# first time an Input register is read as its power-on value is unknown.
+# ============================================================================
+
 # ============================================================================
 # I2C Notes
 # Trigger on a high to low transition of the clock line.
@@ -58,15 +82,12 @@
 #   Read or write to slave devices is indicated with a single bit transmitted after the address bits. A 1 means the command is a read, and a 0 means it is a write.
 # ============================================================================
 
-import copy
-from typing import Optional, List
-import sigrokdecode as srd
-#  ================ For debugging ===============
+import array
+import functools
 import sys
-import os
-sys.path.insert(0, "/home/scirelli/Projects/C1/sigrokdecoder_i2c_PCA9534/.venv/lib/python3.12/site-packages")
-sys.path.insert(0, "/home/scirelli/Projects/C1/sigrokdecoder_i2c_PCA9534/.venv/bin")
-#  ==============================================
+import time
+from typing import Dict, Optional, List, Tuple
+import sigrokdecode as srd
 
 
 I2C_BUS = 2
@@ -81,13 +102,13 @@ def printErr(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
-registers = {
-    INPUT_REG: "Input",
-    OUTPUT_REG: "Output",
-    POLARITY_REG: "Polarity",
-    CONFIG_REG: "Config",
-    I2C_BUS_ADDR: "PCA9534",
-}
+# Diagnostic output levels, see the 'log_level' option.
+# Every call site checks the level first so nothing is formatted when it is off.
+LOG_OFF = 0
+LOG_SUMMARY = 1  # One line per decoded message
+LOG_TRACE = 2  # Every packet and state transition
+_LOG_LEVELS = {"off": LOG_OFF, "summary": LOG_SUMMARY, "trace": LOG_TRACE}
+
 
 START = "START"
 RESTART = "START REPEAT"
@@ -95,12 +116,422 @@ STOP = "STOP"
 ACK = "ACK"
 NACK = "NACK"
 BIT = "BIT"
+BITS = "BITS"
 ADDR_READ = "ADDRESS READ"
 ADDR_WRITE = "ADDRESS WRITE"
 DATA_READ = "DATA READ"
 DATA_WRITE = "DATA WRITE"
 WARN = "WARN"
 
+PIN_CHANGE = "PIN CHANGE"
+TRANSACTION = "TRANSACTION"
+DIR_WRITE = "write"
+DIR_READ = "read"
+
+FAILED_MSG = ("Failed to parse", "Failed", "F")
+START_MSG = ("Start", "S")
+STOP_MSG = ("STOP", "P")
+RESTART_MSG = ("Start repeat", "Sr")
+NOOP_MSG = ("msg_noop", "noop", "n")
+
+# Annotation classes, indices into Decoder.annotations
+ANN_MESSAGE = 0
+ANN_WARNING = 1
+# Each decoded slave gets its own message row, in the order of the 'addresses'
+# option. Devices past MAX_DEVICE_ROWS share rows round robin.
+MAX_DEVICE_ROWS = 8
+ANN_DEVICE_MESSAGES = (ANN_MESSAGE, ) + tuple(range(ANN_WARNING + 1, ANN_WARNING + MAX_DEVICE_ROWS))
+ANN_STATS = ANN_WARNING + MAX_DEVICE_ROWS
+
+# What to do with a transaction that grows past the 'max_packets' option.
+OVERFLOW_FLUSH = "flush"  # Forward what was buffered and annotate a WARN
+OVERFLOW_DROP = "drop"  # Silently discard what was buffered
+
+# What to do with transactions addressed to other slaves, see the 'other_traffic' option.
+OTHER_FORWARD = "forward"  # Pass them downstream untouched, as soon as they arrive
+OTHER_DROP = "drop"  # Filter them out like the i2cfilter decoder
+
+# Decoder statistics, see the 'stats' and 'stats_report' options.
+STATS_OFF = "off"
+STATS_COUNTS = "counts"  # Packet, message, failure and NACK counters
+STATS_TIMING = "timing"  # Counters plus time spent in the decoder, costs a clock read per packet
+REPORT_NONE = "none"
+REPORT_ANNOTATION = "annotation"  # One annotation across the capture at the end of decoding
+REPORT_JSON = "json"  # A JSON object on stderr at the end of decoding
+
+# Commands are interned to small ints once in decode(). The first
+# N_COMMANDS ids are the commands the grammar knows about, 'BITS' and
+# anything unexpected sort after them and never reach the state table.
+COMMANDS = (START, RESTART, STOP, ACK, NACK, ADDR_READ, ADDR_WRITE, DATA_READ, DATA_WRITE)
+N_COMMANDS = len(COMMANDS)
+CMD_START, CMD_RESTART, CMD_STOP, CMD_ACK, CMD_NACK, CMD_ADDR_READ, CMD_ADDR_WRITE, CMD_DATA_READ, CMD_DATA_WRITE = range(N_COMMANDS)
+CMD_BITS = N_COMMANDS
+CMD_OTHER = N_COMMANDS + 1
+_COMMAND_IDS = {cmd: cmd_id for cmd_id, cmd in enumerate(COMMANDS)}
+_COMMAND_IDS[BITS] = CMD_BITS
+_COMMAND_NAMES = COMMANDS + (BITS, "?")
+
+
+# Annotation text is built from (address, register, value) only, so polling
+# loops reading the same register over and over hit the cache instead of
+# formatting the same three strings again.
+ANN_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=ANN_CACHE_SIZE)
+def _write_text(model, address, reg, value):
+    wr_add = hex(address)
+    register = model.register_name(reg)
+    data = f"0b{value:08b}"
+    long, short = model.write_wording(reg)
+    return (f"{model.name} at {wr_add}: {register} {long} {data}", f"{wr_add} {register} {short} {data}", "W")
+
+
+@functools.lru_cache(maxsize=ANN_CACHE_SIZE)
+def _pointer_text(model, address, reg):
+    wr_add = hex(address)
+    register = model.register_name(reg)
+    return (f"{model.name} at {wr_add}: set to read from {register} register", f"{wr_add} {register} set to read", "R")
+
+
+@functools.lru_cache(maxsize=ANN_CACHE_SIZE)
+def _read_text(model, address, reg, value):
+    wr_add = hex(address)
+    data = hex(value)
+    register = None if reg is None else model.register_name(reg)
+    return (f"{model.name} at {wr_add}: Read data {data} from {register} register", f"{wr_add} data {data} {register}", "D")
+
+
+@functools.lru_cache(maxsize=ANN_CACHE_SIZE)
+def _burst_text(model, address, direction, accesses):
+    """Text of a multi-byte access, `accesses` are (register, value) per byte."""
+    wr_add = hex(address)
+    names = [(None if reg is None else model.register_name(reg), value) for reg, value in accesses]
+    if direction == DIR_READ:
+        items = ", ".join(f"{register} {hex(value)}" for register, value in names)
+        return (f"{model.name} at {wr_add}: Read data {items}", f"{wr_add} data {items}", "D")
+    items = ", ".join(f"{register} {value:#010b}" for register, value in names)
+    return (f"{model.name} at {wr_add}: Wrote {items}", f"{wr_add} {items}", "W")
+
+
+class _PacketBuffer:
+    """
+    Transaction buffer stored as parallel columns of ss/es/cmd id/value.
+
+    Storage grows to the longest transaction seen and is reused afterwards,
+    clear() only rewinds the length. 'BITS' packets are not part of the
+    columns, their payload is frozen into tuples and attached to the packet
+    that follows them so they can still be forwarded in order. Commands the
+    decoder does not know are stored as CMD_OTHER with the original
+    (cmd, value) pair as value. `forwarded` counts the packets already
+    handed downstream by forward().
+    """
+    __slots__ = ("ss", "es", "cmd", "value", "bits", "length", "forwarded", "high_water", "_pending_bits")
+
+    def __init__(self, capacity: int = 32):
+        self.ss = [0] * capacity
+        self.es = [0] * capacity
+        self.cmd = [None] * capacity
+        self.value = [None] * capacity
+        self.bits = [None] * capacity
+        self.length = 0
+        self.forwarded = 0
+        self.high_water = 0  # Longest transaction buffered
+        self._pending_bits = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self, ss, es, cmd, value):
+        if cmd == CMD_BITS:
+            # Bits are ((bit, ss, es), ...) and the caller owns the list, keep an immutable copy.
+            bits = ((ss, es, tuple(map(tuple, value))),)
+            self._pending_bits = bits if self._pending_bits is None else self._pending_bits + bits
+            return
+
+        n = self.length
+        if n == len(self.ss):
+            grow = [None] * n
+            self.ss.extend([0] * n)
+            self.es.extend([0] * n)
+            self.cmd.extend(grow)
+            self.value.extend(grow)
+            self.bits.extend(grow)
+        self.ss[n] = ss
+        self.es[n] = es
+        self.cmd[n] = cmd
+        self.value[n] = value
+        self.bits[n] = self._pending_bits
+        self._pending_bits = None
+        self.length = n + 1
+
+    def clear(self):
+        # Drop references to payloads, the storage itself is kept.
+        if self.length > self.high_water:
+            self.high_water = self.length
+        for i in range(self.length):
+            self.bits[i] = None
+        self.length = 0
+        self.forwarded = 0
+        self._pending_bits = None
+
+    def packets(self, limit: int):
+        """(ss, es, cmd, value) tuples of the first `limit` packets, for debug output."""
+        n = min(limit, self.length)
+        return list(zip(self.ss[:n], self.es[:n], [_COMMAND_NAMES[c] for c in self.cmd[:n]], self.value[:n]))
+
+    def forward(self, put, end: Optional[int] = None):
+        """
+        Call put(ss, es, data) for every buffered packet not forwarded yet, in
+        the order they were seen. With `end` only those before that index.
+        """
+        last = self.length if end is None else end
+        for i in range(self.forwarded, last):
+            bits = self.bits[i]
+            if bits is not None:
+                for ss, es, payload in bits:
+                    put(ss, es, [BITS, payload])
+            cmd = self.cmd[i]
+            if cmd == CMD_OTHER:
+                put(self.ss[i], self.es[i], list(self.value[i]))
+            else:
+                put(self.ss[i], self.es[i], [COMMANDS[cmd], self.value[i]])
+        self.forwarded = max(self.forwarded, last)
+        if end is None and self._pending_bits is not None:
+            for ss, es, payload in self._pending_bits:
+                put(ss, es, [BITS, payload])
+            self._pending_bits = None
+
+
+# Register contents after power-on, the Input register follows the pins.
+POWER_ON_REGISTERS = (None, 0xFF, 0x00, 0xFF)
+
+KIND_INPUT = "input"
+KIND_OUTPUT = "output"
+KIND_POLARITY = "polarity"
+KIND_CONFIG = "config"
+
+# (long, short) annotation wording of a register write by KIND_*, followed by the value.
+WRITE_WORDING = {
+    KIND_INPUT: ("pins (read-only) written with", "pins read-only"),
+    KIND_OUTPUT: ("pins pull up/down set to", "pins pull up/down"),
+    KIND_POLARITY: ("pins inversion set to", "pins inversion"),
+    KIND_CONFIG: ("pins set to", "pins to"),
+}
+_UNKNOWN_WORDING = ("set to", "to")
+
+
+class DeviceModel:
+    """
+    Register map of an expander part, see the 'device' option. Registers are
+    8-bit ports numbered by their command byte, a part `width` bits wide has
+    width / 8 consecutive ports per function. With `auto_increment` the
+    register pointer steps to the next port of the function after every data
+    byte and wraps around within it, so a single transaction reads or writes
+    all of its ports.
+    """
+    __slots__ = ("name", "registers", "kinds", "power_on", "width", "auto_increment", "wording")
+
+    def __init__(self, name: str, registers: Tuple[str, ...], kinds: Tuple[str, ...], power_on: Tuple[Optional[int], ...],
+                 width: int, auto_increment: bool, wording: Optional[Dict[str, Tuple[str, str]]] = None):
+        self.name = name
+        self.registers = registers  # Port names by register number
+        self.kinds = kinds  # KIND_* by register number
+        self.power_on = power_on  # Port contents after power-on, None for inputs
+        self.width = width
+        self.auto_increment = auto_increment
+        self.wording = wording or WRITE_WORDING  # (long, short) write wording by KIND_*
+
+    def register_name(self, reg: int) -> str:
+        return self.registers[reg] if 0 <= reg < len(self.registers) else 'Unknown'
+
+    def kind(self, reg: int) -> Optional[str]:
+        return self.kinds[reg] if 0 <= reg < len(self.kinds) else None
+
+    def write_wording(self, reg: int) -> Tuple[str, str]:
+        """(long, short) wording of a write to `reg`, the value follows it."""
+        return self.wording.get(self.kind(reg), _UNKNOWN_WORDING)
+
+    def next_register(self, reg: int) -> int:
+        """Register pointer after a data byte was read from or written to `reg`."""
+        if not self.auto_increment or not 0 <= reg < len(self.registers):
+            return reg
+        ports = self.width // 8
+        return reg - reg % ports + (reg + 1) % ports
+
+
+def _family(names: Tuple[str, ...], width: int, auto_increment: bool) -> Dict[str, DeviceModel]:
+    ports = width // 8
+    functions = ((KIND_INPUT, "Input", None), (KIND_OUTPUT, "Output", 0xFF), (KIND_POLARITY, "Polarity", 0x00), (KIND_CONFIG, "Config", 0xFF))
+    registers = tuple(label if ports == 1 else f"{label} {port}" for _, label, _ in functions for port in range(ports))
+    kinds = tuple(kind for kind, _, _ in functions for _ in range(ports))
+    power_on = tuple(value for _, _, value in functions for _ in range(ports))
+    return {name: DeviceModel(name, registers, kinds, power_on, width, auto_increment) for name in names}
+
+
+# Supported parts by name. The 8-bit parts share the PCA9534 register map,
+# the 16-bit ones pair up ports 0 and 1 of every function.
+DEVICE_MODELS: Dict[str, DeviceModel] = {
+    **_family(("PCA9534", "PCA9538", "PCA9554", "TCA6408", "TCA9534", "TCA9538", "TCA9554"), 8, False),
+    **_family(("PCA9535", "PCA9539", "PCA9555", "TCA6416", "TCA9535", "TCA9539", "TCA9555"), 16, True),
+}
+DEFAULT_DEVICE = "PCA9534"
+
+
+def device_model(options: Optional[Dict[str, object]]) -> DeviceModel:
+    """The DeviceModel selected by the 'device' option."""
+    name = str((options or {}).get('device', DEFAULT_DEVICE)).upper()
+    if name not in DEVICE_MODELS:
+        raise Exception(f"Unknown device {name}, supported are {', '.join(DEVICE_MODELS)}")
+    return DEVICE_MODELS[name]
+
+
+def shadow_changes(regs: List[Optional[int]], reg: int, value: int) -> List[Tuple[int, Optional[int], int]]:
+    """
+    Store `value` as register `reg` of the shadow `regs` and return
+    (pin, old, new) for every pin that changed, all pins when the old value
+    was unknown.
+    """
+    if not 0 <= reg < len(regs):
+        return []
+    old = regs[reg]
+    regs[reg] = value
+    if old is None:
+        return [(pin, None, (value >> pin) & 1) for pin in range(8)]
+    changes = []
+    changed = old ^ value
+    while changed:
+        pin = (changed & -changed).bit_length() - 1
+        changed &= changed - 1
+        changes.append((pin, (old >> pin) & 1, (value >> pin) & 1))
+    return changes
+
+
+class _Device:
+    """State kept per decoded slave, looked up by 7-bit address."""
+    __slots__ = ("address", "ann", "reg_pointer", "regs")
+
+    def __init__(self, address: int, ann: int, power_on: Tuple[Optional[int], ...] = POWER_ON_REGISTERS):
+        self.address = address
+        self.ann = ann  # Annotation class of the device's message row
+        # The command byte selects the register later reads return, it
+        # sticks until the next write unless the part auto-increments.
+        self.reg_pointer: Optional[int] = None
+        # Shadow of the registers as last written or read.
+        self.regs: List[Optional[int]] = list(power_on)
+
+
+def parse_addresses(text: str) -> List[int]:
+    """
+    Parse a slave address set such as "0x20-0x27", "32,33,36" or
+    "0x20-0x23,0x38". Numbers may be given in any base int() accepts.
+    """
+    addresses: List[int] = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        lo = int(first, 0)
+        hi = int(last, 0) if last else lo
+        if not 0 <= lo <= hi <= 127:
+            raise Exception(f"Invalid slave address range (must be 0..127). {part}")
+        addresses.extend(a for a in range(lo, hi + 1) if a not in addresses)
+    return addresses
+
+
+class _Transaction:
+    """
+    Progress of the current transaction segment, filled in as packets arrive.
+    first is the buffer index of its START. addr/reg/data are buffer indices
+    of the slave address, register pointer and data bytes, -1 until seen.
+    device is set once the address matched. announced is set when streaming
+    emitted the message ahead of the STOP.
+    """
+    __slots__ = ("first", "addr", "reg", "data", "device", "announced")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.first = 0
+        self.addr = -1
+        self.reg = -1
+        self.data = -1
+        self.device: Optional[_Device] = None
+        self.announced = False
+
+
+class _TraceRing:
+    """
+    The most recent packets packed as int64 ss/es/cmd/value quadruples into a
+    preallocated array. Recording is a few stores, nothing is formatted until
+    the ring is dumped.
+    """
+    __slots__ = ("_data", "_size", "_next", "_count")
+
+    def __init__(self, size: int):
+        self._data = array.array("q", bytes(8 * 4 * size))
+        self._size = size
+        self._next = 0
+        self._count = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def record(self, ss, es, cmd, value):
+        i = self._next << 2
+        data = self._data
+        data[i] = ss
+        data[i + 1] = es
+        data[i + 2] = cmd
+        data[i + 3] = value if value.__class__ is int else -1
+        self._next = (self._next + 1) % self._size
+        self._count += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def records(self):
+        """Recorded (ss, es, cmd, value) tuples, oldest first."""
+        n = min(self._count, self._size)
+        first = (self._next - n) % self._size
+        data = self._data
+        out = []
+        for k in range(n):
+            i = ((first + k) % self._size) << 2
+            code = data[i + 2]
+            value = data[i + 3]
+            out.append((data[i], data[i + 1], _COMMAND_NAMES[code], value if value >= 0 else None))
+        return out
+
+    def dump(self, reason: str):
+        printErr(f"PCA9534 trace ({reason}), last {min(self._count, self._size)} of {self._count} packets:")
+        for ss, es, cmd, value in self.records():
+            printErr(f"\t{ss}-{es}\t{cmd}\t{'' if value is None else hex(value)}")
+
+
+class _Stats:
+    """
+    Runtime counters of one decoder. The *_seconds totals nest: decode
+    includes transitions, which include the message output they trigger.
+    """
+    __slots__ = ("packets", "nacks", "messages", "parse_failures", "violations", "first_ss", "last_es",
+                 "decode_seconds", "transition_seconds", "output_seconds")
+
+    def __init__(self):
+        self.packets = 0
+        self.nacks = 0
+        self.messages: Dict[str, int] = {}
+        self.parse_failures = 0
+        self.violations = 0
+        self.first_ss = -1
+        self.last_es = -1
+        self.decode_seconds = 0.0
+        self.transition_seconds = 0.0
+        self.output_seconds = 0.0
+
 
 # Notes:
 # Allow BITs messages to pass through.
@@ -114,13 +545,23 @@ class Decoder(srd.Decoder):
     desc = "Requires to be stacked on top of I²C filter decoder and filtered by the PCA9534 address. This will then decode the I²C PCA9534 messages."
     license = "gplv3+"
     inputs = ["i2c"]
-    outputs = ["i2c"]
+    outputs = ["i2c", "pca9534"]
     tags = ["Util"]
-    _parsable_commands = (START, ADDR_WRITE, ADDR_READ, ACK, NACK, DATA_WRITE, DATA_READ, STOP, RESTART)
-    _end_states = (STOP, RESTART)
 
     options = (
         {'id': 'address', 'desc': 'Slave (PCA9534) address (decimal)', 'default': 0x20},
+        {'id': 'addresses', 'desc': 'Slave address set, e.g. 0x20-0x27 (overrides address)', 'default': ''},
+        {'id': 'device', 'desc': 'Expander part', 'default': DEFAULT_DEVICE, 'values': tuple(DEVICE_MODELS)},
+        {'id': 'log_level', 'desc': 'Diagnostic output to stderr', 'default': 'off', 'values': ('off', 'summary', 'trace')},
+        {'id': 'trace_buffer', 'desc': 'Packets kept for a trace dump on errors (0 = off)', 'default': 0},
+        {'id': 'max_packets', 'desc': 'Longest transaction buffered, in packets (0 = unlimited)', 'default': 1024},
+        {'id': 'overflow', 'desc': 'Overlong transactions', 'default': OVERFLOW_FLUSH, 'values': (OVERFLOW_FLUSH, OVERFLOW_DROP)},
+        {'id': 'other_traffic', 'desc': 'Traffic for other slaves', 'default': OTHER_FORWARD, 'values': (OTHER_FORWARD, OTHER_DROP)},
+        {'id': 'annotations', 'desc': 'Build annotations (no = OUTPUT_PYTHON only)', 'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'streaming', 'desc': 'Emit transactions at their last byte, not their STOP', 'default': 'no', 'values': ('no', 'yes')},
+        {'id': 'events', 'desc': "TRANSACTION and PIN CHANGE packets on OUTPUT_PYTHON ('pca9534')", 'default': 'no', 'values': ('no', 'yes')},
+        {'id': 'stats', 'desc': 'Decoder statistics', 'default': STATS_OFF, 'values': (STATS_OFF, STATS_COUNTS, STATS_TIMING)},
+        {'id': 'stats_report', 'desc': 'Statistics at end of decoding', 'default': REPORT_NONE, 'values': (REPORT_NONE, REPORT_ANNOTATION, REPORT_JSON)},
     )
 
     annotations = (
@@ -130,10 +571,16 @@ class Decoder(srd.Decoder):
         # ("data-read", "Data read"),  # 2
         # ("data-write", "Data write"),  # 3
         ("message", "Message"),  # 0
+        ("warning", "Warning"),  # 1
+    ) + tuple((f"message-{i}", f"Message, device {i + 1}") for i in range(1, MAX_DEVICE_ROWS)) + (  # 2..8
+        ("stats", "Statistics"),  # 9
     )
     annotation_rows = (
         # id, name/description, tuple of indices
-        ("pca9543-message", "Messages", (0, )),  # 0
+        ("pca9543-message", "Device 1", (ANN_MESSAGE, )),  # 0
+    ) + tuple((f"pca9534-device-{i}", f"Device {i + 1}", (ANN_DEVICE_MESSAGES[i], )) for i in range(1, MAX_DEVICE_ROWS)) + (
+        ("pca9534-warnings", "Warnings", (ANN_WARNING, )),
+        ("pca9534-stats", "Statistics", (ANN_STATS, )),
     )
 
     def __init__(self):
@@ -141,285 +588,771 @@ class Decoder(srd.Decoder):
         # import rpdb2
         # rpdb2.start_embedded_debugger("steve", fAllowRemote=True, timeout=50000000)
         #  ==============================================
-        self._filter_addr = 0x20
-        self._is_pca5934_packet = False
+        # Decoded slaves indexed by 7-bit address, None for everybody else.
+        self._devices: List[Optional[_Device]] = [None] * 128
+        self._model = DEVICE_MODELS[DEFAULT_DEVICE]
+        self._txn = _Transaction()
         self.out_python: srd.OutputType
         self.out_ann: srd.OutputType
-        self._seen_packets = []
-        self._state = _state_machine
-        self._reg_to_read = None
+        self.out_events: Optional[srd.OutputType] = None
+        self._seen_packets = _PacketBuffer()
+        self._state = ROOT_STATE
+        self._log_level = LOG_OFF
+        self._trace: Optional[_TraceRing] = None
+        self._max_packets = sys.maxsize
+        self._overflow_flush = True
+        self.overflows = 0  # Transactions cut short because they exceeded 'max_packets'
+        self._forward_other = True
+        # Bypassing the rest of a segment, one for another slave or one that
+        # overflowed. Bypassed packets are forwarded when _bypass_forward is set.
+        self._bypass = False
+        self._bypass_forward = True
+        self._overflowed = False
+        self._annotate = True
+        self._stream = False
+        self._events = False
+        self._stats: Optional[_Stats] = None
+        self._timing = False
+        self._stats_report = REPORT_NONE
         self.reset()
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._bind_builders()
+
+    @classmethod
+    def _bind_builders(cls):
+        # Message builder function per state id, looked up once per class so
+        # neither dispatch nor instantiation pays for getattr().
+        cls._state_builders = tuple(getattr(cls, name) if name else None for name in STATE_BUILDERS)
+        cls._early_state_builders = tuple(getattr(cls, name) if name else None for name in EARLY_BUILDERS)
+
     def reset(self):
-        self._is_pca5934_packet = False
-        self._state = _state_machine
+        self._bypass = False
+        self._overflowed = False
+        self._txn.clear()
+        self._state = ROOT_STATE
         self._seen_packets.clear()
 
     def start(self):
         self.out_python = self.register(srd.OUTPUT_PYTHON, proto_id="i2c")  # Used to pass data to the next decoder
         self.out_ann = self.register(srd.OUTPUT_ANN, proto_id="i2c")  # Used to display text in PulseView
+        # Transactions and pin change events. A stacked decoder receives every
+        # OUTPUT_PYTHON packet, so they are only put when asked for.
+        self._events = self.options.get('events', 'no') == 'yes'
+        self.out_events = self.register(srd.OUTPUT_PYTHON, proto_id="pca9534") if self._events else None
 
-        if 0 >= int(self.options['address']) >= 127:
+        if not 0 <= int(self.options['address']) <= 127:
             raise Exception(f"Invalid slave (must be 0..127). {self.options['address']}")
 
-        if self.options['address']:
-            self._filter_addr = int(self.options['address'])
-
-    # Accumulate observed I2C packets until a STOP or REPEATED START
-    # condition is seen. These are conditions where transfers end or
-    # where direction potentially changes. Forward all previously
-    # accumulated traffic if it passes the slave address and direction
-    # filter. This assumes that the slave address as well as the read
-    # or write direction was part of the observed traffic. There should
-    # be no surprise when incomplete traffic does not match the filter
-    # condition.
+        addresses = parse_addresses(str(self.options.get('addresses', '')))
+        if not addresses:
+            addresses = [int(self.options['address']) or I2C_BUS_ADDR]
+        self._model = device_model(self.options)
+        self._devices = [None] * 128
+        for i, address in enumerate(addresses):
+            self._devices[address] = _Device(address, ANN_DEVICE_MESSAGES[i % MAX_DEVICE_ROWS], self._model.power_on)
+
+        self._log_level = _LOG_LEVELS.get(self.options.get('log_level', 'off'), LOG_OFF)
+        trace_size = int(self.options.get('trace_buffer', 0))
+        if trace_size <= 0:
+            self._trace = None
+        elif self._trace is not None and self._trace.size == trace_size:
+            self._trace.clear()  # Restarted, keep the ring
+        else:
+            self._trace = _TraceRing(trace_size)
+
+        max_packets = int(self.options.get('max_packets', 0))
+        self._max_packets = max_packets if max_packets > 0 else sys.maxsize
+        self._overflow_flush = self.options.get('overflow', OVERFLOW_FLUSH) == OVERFLOW_FLUSH
+        self._forward_other = self.options.get('other_traffic', OTHER_FORWARD) == OTHER_FORWARD
+        self._annotate = self.options.get('annotations', 'yes') == 'yes'
+        self._stream = self.options.get('streaming', 'no') == 'yes'
+        stats = self.options.get('stats', STATS_OFF)
+        self._stats = _Stats() if stats != STATS_OFF else None
+        self._timing = stats == STATS_TIMING
+        self._stats_report = self.options.get('stats_report', REPORT_NONE)
+
+    def stop(self):
+        self.flush()
+
+    def flush(self):
+        """
+        End of stream, finish the transaction in progress. One that only
+        lacks its STOP is decoded, anything else is forwarded and flagged with
+        a warning instead of being lost.
+        """
+        packets = self._seen_packets
+        txn = self._txn
+        if packets.length and not self._bypass:
+            last = packets.length - 1
+            builder = None
+            if not txn.announced and txn.device is not None:
+                builder = self._early_state_builders[self._state]
+                stop_state = TRANSITIONS[self._state * N_COMMANDS + CMD_STOP]
+                if builder is None and stop_state != self._state:
+                    builder = self._state_builders[stop_state]  # Whatever a STOP would have completed
+            if builder is not None:
+                self._put_gui_text(packets, txn, builder, last)
+            elif not txn.announced and self._state != ERROR_STATE:
+                ss = packets.ss[0]
+                es = packets.es[last]
+                if self._annotate:
+                    self._put_gui(ss, es, ANN_WARNING, [f"{WARN}: incomplete transaction at end of capture", f"{WARN}: incomplete", "!"])
+                if self._log_level >= LOG_SUMMARY:
+                    printErr(f"{ss}-{es}: {WARN} incomplete transaction at end of capture")
+            self._forward_seen_packets()
+        self.reset()
+        self._report_stats()
+
+    def stats(self) -> Optional[Dict[str, object]]:
+        """Counters collected so far, None unless the 'stats' option is on."""
+        stats = self._stats
+        if stats is None:
+            return None
+        report = {
+            "packets": stats.packets,
+            "messages": dict(stats.messages),
+            "parse_failures": stats.parse_failures,
+            "grammar_violations": stats.violations,
+            "nacks": stats.nacks,
+            "overflows": self.overflows,
+            "buffer_high_water": self._seen_packets.high_water,
+        }
+        if self._timing:
+            report["decode_seconds"] = stats.decode_seconds
+            report["transition_seconds"] = stats.transition_seconds
+            report["output_seconds"] = stats.output_seconds
+        return report
+
+    def _report_stats(self):
+        report = self.stats()
+        if report is None or self._stats_report == REPORT_NONE:
+            return
+        if self._stats_report == REPORT_JSON:
+            import json  # pylint: disable=import-outside-toplevel
+
+            printErr(json.dumps(report))
+        elif self._stats.packets and self._annotate:
+            messages = sum(report["messages"].values())
+            self._put_gui(self._stats.first_ss, self._stats.last_es, ANN_STATS, [
+                f"{report['packets']} packets, {messages} messages, {report['parse_failures']} failed, {report['nacks']} NACKs",
+                f"{report['packets']} packets, {messages} messages",
+                f"{messages}",
+            ])
+
+    # Advance the transaction state machine with every I2C packet as it
+    # arrives and emit the annotation as soon as a terminal state is
+    # reached, the buffer is never scanned again. Observed packets are
+    # still accumulated until a STOP or REPEATED START condition is seen,
+    # these are conditions where transfers end or where direction
+    # potentially changes, and then forwarded downstream. Once the slave
+    # address following a START or REPEATED START shows a segment is for
+    # another device nothing more of it is buffered, it is passed through or
+    # dropped as it arrives.
+    #
+    # With the 'streaming' option a transaction is emitted by the packet
+    # that makes it unambiguous: the final ACK/NACK of register writes and
+    # reads, the STOP or REPEATED START of a register pointer write. Packets
+    # of our own segments are forwarded as soon as the address matched.
     def decode(self, start_sample, end_sample, data):
-        # Unconditionally accumulate every lower layer packet we see.
-        # Keep deep copies for later, only reference caller's values
-        # as long as this .decode() invocation executes.
-        self._seen_packets.append([start_sample, end_sample, copy.deepcopy(data)])
-        self._is_pca5934_packet = self._is_pca9534_device(data) or self._is_pca5934_packet
-
-        cmd, _ = data
-        if cmd in self._end_states:
+        cmd, value = data
+        cmd_id = _COMMAND_IDS.get(cmd, CMD_OTHER)
+        if self._trace is not None:
+            self._trace.record(start_sample, end_sample, cmd_id, value)
+        stats = self._stats
+        if stats is not None:
+            t0 = time.perf_counter() if self._timing else 0.0
+            stats.packets += 1
+            if cmd_id == CMD_NACK:
+                stats.nacks += 1
+            if stats.first_ss < 0:
+                stats.first_ss = start_sample
+            stats.last_es = end_sample
+
+        if self._bypass:
+            if self._overflowed and (cmd_id == CMD_START or cmd_id == CMD_RESTART):
+                self.reset()  # Decoded again from this condition on
+            else:
+                if self._bypass_forward:
+                    self._put_python(start_sample, end_sample, data)
+                if cmd_id == CMD_STOP:
+                    self.reset()
+                elif cmd_id == CMD_RESTART:
+                    self._bypass = False
+                    self._state = RESTART_STATE
+                if self._timing:
+                    stats.decode_seconds += time.perf_counter() - t0
+                return
+
+        # Accumulate every lower layer packet of the segment. Only scalars and
+        # frozen copies of 'BITS' are kept, the caller's data list is only
+        # referenced while this .decode() invocation executes.
+        if cmd_id == CMD_OTHER:
+            value = (cmd, value)
+        packets = self._seen_packets
+        packets.append(start_sample, end_sample, cmd_id, value)
+        if cmd_id < N_COMMANDS:
+            if self._timing:
+                t1 = time.perf_counter()
+                self._decode_pca9534(cmd_id, value, packets.length - 1)
+                stats.transition_seconds += time.perf_counter() - t1
+            else:
+                self._decode_pca9534(cmd_id, value, packets.length - 1)
+        if self._stream and self._txn.device is not None:
             self._forward_seen_packets()
 
-            if self._is_pca5934_packet:
-                self._process_pca9543_packets()
-                if cmd == RESTART:
-                    self._seen_packets.clear()
+        if cmd_id == CMD_STOP or cmd_id == CMD_RESTART:
+            self._forward_seen_packets()
+            packets.clear()
+            self._txn.clear()
 
-            if cmd == STOP:
+            if cmd_id == CMD_STOP:
                 self.reset()
+        elif packets.length >= self._max_packets:
+            self._overflow()
+        if self._timing:
+            stats.decode_seconds += time.perf_counter() - t0
+
+    # Message builders apply a decoded transaction to the device model and
+    # return the (long, medium, short) annotation text, None when
+    # annotations are switched off, or FAILED_MSG.
 
-    def msg_write_to_register(self, packets) -> List[str]:
+    def msg_write_to_register(self, packets, txn) -> Optional[Tuple[str, ...]]:
         """
         Write to X register value V
           0          1          2         3          4         5          6       7
         START -> ADDR_WRITE -> ACK -> DATA_WRITE -> ACK -> DATA_WRITE -> ACK -> STOP
+        Parts that auto-increment take further DATA_WRITE/ACK pairs as the
+        following ports, otherwise they are ignored.
         """
-        msg = ["Failed to parse", "Failed", "F"]
+        if txn.addr == -1 or txn.data == -1:
+            return FAILED_MSG
 
-        start_idx = self._get_cmd_index(ADDR_WRITE, packets)
-        if start_idx != -1:
-            printErr("\tmsg_write_to_register", packets[:9], len(packets) , "...")
-            wr_add = hex(packets[start_idx][2][1])
-            register = registers.get(packets[start_idx + 2][2][1], 'Unknown')
-            data = f"0b{packets[start_idx + 4][2][1]:08b}"
+        if self._log_level >= LOG_TRACE:
+            printErr("\tmsg_write_to_register", packets.packets(9), len(packets), "...")
+        model = self._model
+        device = txn.device
+        reg = packets.value[txn.reg]
+        if not model.auto_increment:
+            value = packets.value[txn.data]
+            device.reg_pointer = reg
+            self._put_transaction(packets, txn, DIR_WRITE, reg, value, txn.data)
+            if model.kind(reg) != KIND_INPUT:
+                self._update_shadow(device, reg, value, packets.ss[txn.data], packets.es[txn.data])
+            return _write_text(model, device.address, reg, value) if self._annotate else None
 
-            if register == registers[CONFIG_REG]:
-                msg = [f"PCA9534 at {wr_add}: {register} pins set to {data}", f"{wr_add} {register} pins to {data}", "W"]
-            else:
-                msg = [f"PCA9534 at {wr_add}: {register} pins pull up/down set to {data}", f"{wr_add} {register} pins pull up/down {data}", "W"]
-
-        return msg
+        accesses = []
+        for i in self._data_bytes(packets, txn.data, CMD_DATA_WRITE):
+            value = packets.value[i]
+            self._put_transaction(packets, txn, DIR_WRITE, reg, value, i)
+            if model.kind(reg) != KIND_INPUT:
+                self._update_shadow(device, reg, value, packets.ss[i], packets.es[i])
+            accesses.append((reg, value))
+            reg = model.next_register(reg)
+        device.reg_pointer = reg
+        if not self._annotate:
+            return None
+        if len(accesses) == 1:
+            return _write_text(model, device.address, *accesses[0])
+        return _burst_text(model, device.address, DIR_WRITE, tuple(accesses))
 
-    def msg_set_register_as_read_from(self, packets) -> List[str]:
+    def msg_set_register_as_read_from(self, packets, txn) -> Optional[Tuple[str, ...]]:
         """
         Set X register as register to read from.
         START -> ADDR_WRITE -> ACK -> DATA_WRITE -> ACK -> STOP
         """
-        msg = ["Failed to parse", "Failed", "F"]
-
-        start_idx = self._get_cmd_index(ADDR_WRITE, packets)
-        if start_idx != -1:
-            printErr("\tmsg_set_register_as_read_from", packets[:7], len(packets), "...")
-            wr_add = hex(packets[start_idx][2][1])
-            register = registers.get(packets[start_idx + 2][2][1], 'Unknown')
-            self._reg_to_read = register
-            msg = [f"PCA9534 at {wr_add}: set to read from {register} register", f"{wr_add} {register} set to read", "R"]
-        return msg
-
-    def msg_read_from_register(self, packets) -> List[str]:
+        if txn.addr == -1 or txn.reg == -1:
+            return FAILED_MSG
+
+        if self._log_level >= LOG_TRACE:
+            printErr("\tmsg_set_register_as_read_from", packets.packets(7), len(packets), "...")
+        reg = packets.value[txn.reg]
+        txn.device.reg_pointer = reg
+        self._put_transaction(packets, txn, DIR_WRITE, reg, None, txn.reg)
+
+        return _pointer_text(self._model, txn.device.address, reg) if self._annotate else None
+
+    def msg_read_from_register(self, packets, txn) -> Optional[Tuple[str, ...]]:
         """
         Read from X register
         START -> ADDR_READ -> ACK -> DATA_READ -> ACK -> STOP
+        Parts that auto-increment take further DATA_READ/ACK pairs as the
+        following ports, otherwise they are ignored.
         """
-        msg = ["Failed to parse", "Failed", "F"]
-
-        start_idx = self._get_cmd_index(ADDR_READ, packets)
-        if start_idx != -1:
-            printErr("\tmsg_read_from_register", packets[:7], len(packets), "...")
-            wr_add = hex(packets[start_idx][2][1])
-            data = hex(packets[start_idx + 2][2][1])
-            register = self._reg_to_read
-            self._reg_to_read = None
-            msg = [f"PCA9534 at {wr_add}: Read data {data} from {register} register", f"{wr_add} data {data} {register}", "D"]
-
-        return msg
-
-    def msg_noop(self, packets) -> str:
-        printErr("\tmsg_noop", packets[:8], len(packets), "...")
-        return ["msg_noop", "noop", "n"]
-
-    def _is_pca9534_device(self, packet) -> bool:
-        cmd, slave_addr = packet
-        if cmd in ('ADDRESS READ', 'ADDRESS WRITE'):
-            slave_addr = int(slave_addr)
-            if slave_addr == self._filter_addr:
-                printErr("Found valid address")
-                return True
-            printErr(f"Skipping address; {slave_addr} != {self._filter_addr}")
-
-        return False
-
-    def _process_pca9543_packets(self):
-        for packet in self._seen_packets:
-            self._decode_pca9534(*packet)
-
-    def _decode_pca9534(self, start_sample, end_sample, data):
-        printErr(f"█████████████████████████████████\n\tStart Idx:{start_sample}\n\tEnd Idx: {end_sample}\n\tData: {data}\n")
-        cmd, _ = data
-        if cmd not in self._parsable_commands:
-            printErr(f"Not a parsable command {cmd}")
+        if txn.addr == -1 or txn.data == -1:
+            return FAILED_MSG
+
+        if self._log_level >= LOG_TRACE:
+            printErr("\tmsg_read_from_register", packets.packets(7), len(packets), "...")
+        model = self._model
+        device = txn.device
+        reg = device.reg_pointer
+        if not model.auto_increment:
+            value = packets.value[txn.data]
+            self._put_transaction(packets, txn, DIR_READ, reg, value, txn.data)
+            if reg is not None:
+                self._update_shadow(device, reg, value, packets.ss[txn.data], packets.es[txn.data])
+            return _read_text(model, device.address, reg, value) if self._annotate else None
+
+        accesses = []
+        for i in self._data_bytes(packets, txn.data, CMD_DATA_READ):
+            value = packets.value[i]
+            self._put_transaction(packets, txn, DIR_READ, reg, value, i)
+            accesses.append((reg, value))
+            if reg is not None:
+                self._update_shadow(device, reg, value, packets.ss[i], packets.es[i])
+                reg = model.next_register(reg)
+        device.reg_pointer = reg
+        if not self._annotate:
+            return None
+        if len(accesses) == 1:
+            return _read_text(model, device.address, *accesses[0])
+        return _burst_text(model, device.address, DIR_READ, tuple(accesses))
+
+    def _data_bytes(self, packets, first, cmd) -> List[int]:
+        """Buffer indices of the `cmd` data bytes from index `first` on."""
+        packet_cmd = packets.cmd
+        return [i for i in range(first, packets.length) if packet_cmd[i] == cmd]
+
+    def msg_noop(self, packets, txn) -> Optional[Tuple[str, ...]]:
+        if self._log_level >= LOG_TRACE:
+            printErr("\tmsg_noop", packets.packets(8), len(packets), "...")
+        return NOOP_MSG if self._annotate else None
+
+    def _put_transaction(self, packets, txn, direction, reg, value, last):
+        """Emit a TRANSACTION event, `last` is the buffer index of the final byte."""
+        if not self._events:
+            return
+        ack = last + 1
+        acked = ack < packets.length and packets.cmd[ack] == CMD_ACK
+        es = packets.es[ack] if ack < packets.length else packets.es[last]
+        self._put_event(packets.ss[txn.addr], es, [TRANSACTION, (txn.device.address, direction, reg, value, acked)])
+
+    def _update_shadow(self, device, reg, value, ss, es):
+        """Store a register value seen on the bus and emit a PIN CHANGE for every bit that flipped."""
+        changes = shadow_changes(device.regs, reg, value)
+        if self._events:
+            for pin, old, new in changes:
+                self._put_event(ss, es, [PIN_CHANGE, (device.address, reg, pin, old, new)])
+
+    def shadow(self, address: int) -> Dict[str, Optional[int]]:
+        """Last known register values of the device at `address`, by register name."""
+        device = self._devices[address]
+        if device is None:
+            raise KeyError(f"Address {address:#x} is not decoded")
+        return {self._model.register_name(reg): value for reg, value in enumerate(device.regs)}
+
+    @property
+    def model(self) -> DeviceModel:
+        """Model of the decoded parts, from the 'device' option."""
+        return self._model
+
+    @property
+    def max_packets(self) -> int:
+        """Longest transaction kept in the buffer, sys.maxsize when unlimited."""
+        return self._max_packets
+
+    def addresses(self) -> List[int]:
+        """7-bit addresses of the decoded slaves."""
+        return [device.address for device in self._devices if device is not None]
+
+    def register_pointer(self, address: int) -> Optional[int]:
+        """Register the next read of the device at `address` returns, None when not known."""
+        device = self._devices[address]
+        if device is None:
+            raise KeyError(f"Address {address:#x} is not decoded")
+        return device.reg_pointer
+
+    def set_register_pointer(self, address: int, reg: Optional[int]):
+        """Set the register pointer of the device at `address`, as if written on the bus before."""
+        device = self._devices[address]
+        if device is None:
+            raise KeyError(f"Address {address:#x} is not decoded")
+        device.reg_pointer = reg
+
+    def _find_device(self, slave_addr) -> Optional[_Device]:
+        device = self._devices[int(slave_addr) & 0x7F]
+        if self._log_level >= LOG_TRACE:
+            printErr(f"Found valid address {slave_addr}" if device is not None else f"Skipping address {slave_addr}")
+        return device
+
+    def _decode_pca9534(self, cmd, value, idx):
+        """Advance the state machine with the parsable packet at buffer index `idx`."""
+        txn = self._txn
+        device = None
+        if cmd == CMD_ADDR_WRITE or cmd == CMD_ADDR_READ:
+            device = self._find_device(value)
+            if device is None and _OPENS_SEGMENT[self._state]:
+                self._skip_segment()
+                return
+
+        state = self._state
+        nxt = TRANSITIONS[state * N_COMMANDS + cmd]
+        if self._log_level >= LOG_TRACE:
+            printErr(f"_decode_pca9534 {_COMMAND_NAMES[cmd]} {value} state: {state} -> {nxt} {STATE_BUILDERS[nxt] or ''}")
+        if nxt == state:
             return
+        if nxt >= ERROR_STATE:
+            self._grammar_violation(cmd, idx, nxt)
+            return
+        # Only packets the grammar took are recorded, an ignored or rejected
+        # one leaves the transaction as it was.
+        if cmd == CMD_START:
+            txn.clear()
+            txn.first = idx
+        elif cmd == CMD_ADDR_WRITE or cmd == CMD_ADDR_READ:
+            txn.addr = idx
+            txn.reg = -1
+            txn.data = -1
+            txn.device = device
+        elif cmd == CMD_DATA_WRITE:
+            # First byte written is the register pointer, the second the register value.
+            if txn.reg == -1:
+                txn.reg = idx
+            elif txn.data == -1:
+                txn.data = idx
+        elif cmd == CMD_DATA_READ:
+            if txn.data == -1:
+                txn.data = idx
 
-        printErr(f"\t_decode_pca9534 - Pre-state: \n\t\t{self._state}"[:200] + "\n")
-        self._state = self._state.get(cmd, self._state)
-        printErr(f"\t_decode_pca9534 - State: \n\t\t{self._state}"[:200])
-        if callable(getattr(self, self._state.get("build_gui_text", ""), False)):
-            self._put_gui_text(list(filter(lambda x: x[2][0] in self._parsable_commands, self._seen_packets)))
+        self._state = nxt
+        if txn.device is None:
+            return
+        builder = self._state_builders[nxt]
+        if txn.announced:
+            # Streamed ahead, only the closing condition is left to annotate.
+            if builder is not None and self._annotate:
+                self._put_condition(self._seen_packets, txn, idx)
+            return
+        if builder is None and self._stream and not (cmd == CMD_ACK and self._model.auto_increment):
+            # An ACKed byte may be followed by more of a burst, wait for its end.
+            builder = self._early_state_builders[nxt]
+            txn.announced = builder is not None
+        if builder is not None:
+            self._put_gui_text(self._seen_packets, txn, builder, idx)
+
+    def _put_gui_text(self, packets, txn, builder, last):
+        if self._log_level >= LOG_TRACE:
+            printErr(f"\tbuild_gui_text: {builder.__name__} {packets.packets(5)} ...")
+        t0 = time.perf_counter() if self._timing else 0.0
+        message = builder(self, packets, txn)
+        failed = message is FAILED_MSG
+        stats = self._stats
+        if stats is not None and not failed:
+            stats.messages[builder.__name__] = stats.messages.get(builder.__name__, 0) + 1
+        if message is None:
+            if self._timing:
+                stats.output_seconds += time.perf_counter() - t0
+            return
 
-    def _put_gui_text(self, text_list):
-        printErr(f"\t_decode_pca9534 - build_gui_text: \n\t\t{text_list[:5]} ...\n")
         msgs = []
-        start = self._seen_packets[0][0]
-        end = self._seen_packets[-1][1]
+        first = txn.first
+        start = packets.ss[first]
+        end = packets.es[last]
 
-        if self._seen_packets[0][2][0] == START:
+        if packets.cmd[first] == CMD_START:
             msgs.append([
-                self._seen_packets[0][0],
-                self._seen_packets[0][1],
-                0,
-                ["Start", "S"],
+                packets.ss[first],
+                packets.es[first],
+                txn.device.ann,
+                START_MSG,
             ])
-            start = self._seen_packets[1][0]
+            start = packets.ss[first + 1]
 
-        if self._seen_packets[-1][2][0] in (STOP, RESTART):
+        if packets.cmd[last] == CMD_STOP or packets.cmd[last] == CMD_RESTART:
             msgs.append([
-                self._seen_packets[-1][0],
-                self._seen_packets[-1][1],
-                0,
-                ["STOP", "P"] if self._seen_packets[-1][2][0] == STOP else ["Start repeat", "Sr"],
+                packets.ss[last],
+                packets.es[last],
+                txn.device.ann,
+                STOP_MSG if packets.cmd[last] == CMD_STOP else RESTART_MSG,
             ])
-            end = self._seen_packets[-2][1]
+            end = packets.es[max(last - 1, first)]
 
         msgs.append([
             start,
             end,
-            0,
-            getattr(self, self._state["build_gui_text"])(text_list)
+            txn.device.ann,
+            message,
         ])
 
-        for v in msgs:
-            self._put_gui(*v)
+        if failed:
+            self._on_parse_error(start, end, builder.__name__)
+        elif self._log_level >= LOG_SUMMARY:
+            printErr(f"{start}-{end}: {message[0]}")
+
+        if self._annotate:
+            for v in msgs:
+                self._put_gui(*v)
+        if self._timing:
+            stats.output_seconds += time.perf_counter() - t0
+
+    def _grammar_violation(self, cmd, idx, nxt):
+        """
+        The packet at buffer index `idx` cannot follow in the current state,
+        a missed ACK, a spurious START or the like. Flag the transaction up to
+        it and resynchronize: at this very packet when it is a START or
+        REPEATED START, otherwise at the next one. A message that was
+        already certain is still emitted, otherwise the register pointer of
+        a device that was sent a command byte is no longer known.
+        """
+        packets = self._seen_packets
+        txn = self._txn
+        resync = nxt == RESYNC_STATE
+        builder = self._early_state_builders[self._state] if resync and not txn.announced else None
+        if txn.device is not None:
+            if builder is not None:
+                self._put_gui_text(packets, txn, builder, idx - 1)
+            elif POINTER_SENT[self._state] and not txn.announced:
+                self._forget_pointer(txn.device)
+
+        ss = packets.ss[txn.first]
+        es = packets.es[idx]
+        name = _COMMAND_NAMES[cmd]
+        if self._stats is not None:
+            self._stats.violations += 1
+        if self._annotate:
+            self._put_gui(ss, es, ANN_WARNING, [
+                f"{WARN}: unexpected {name}, " + ("restarted here" if resync else "skipped to the next START"),
+                f"{WARN}: unexpected {name}",
+                "!",
+            ])
+        if self._log_level >= LOG_SUMMARY:
+            printErr(f"{ss}-{es}: {WARN} unexpected {name} in state {self._state}")
+        if self._trace is not None:
+            self._trace.dump(f"unexpected {name} at {ss}-{es}")
+
+        if resync:
+            txn.clear()
+            txn.first = idx
+            self._state = TRANSITIONS[ROOT_STATE * N_COMMANDS + cmd]
+        else:
+            self._state = ERROR_STATE
+
+    def _forget_pointer(self, device):
+        device.reg_pointer = None
+
+    def _put_condition(self, packets, txn, last):
+        self._put_gui(
+            packets.ss[last],
+            packets.es[last],
+            txn.device.ann,
+            STOP_MSG if packets.cmd[last] == CMD_STOP else RESTART_MSG,
+        )
+
+    def _skip_segment(self):
+        """
+        The segment is for another slave, hand off what was buffered and bypass
+        the rest of it. Packets ahead of the START the segment began with, left
+        over from a transaction that lost its STOP, are not part of it and are
+        forwarded either way.
+        """
+        if self._forward_other:
+            self._forward_seen_packets()
+        elif self._txn.first:
+            self._forward_seen_packets(self._txn.first)
+        self._seen_packets.clear()
+        self._txn.clear()
+        self._bypass = True
+        self._bypass_forward = self._forward_other
+
+    def _overflow(self):
+        """
+        The transaction has run past 'max_packets' without a STOP or REPEATED
+        START, typically a glitching bus or a capture starting mid-transfer.
+        Give up on it and bypass the rest up to the next START, REPEATED START
+        or STOP, counted and annotated once.
+        """
+        packets = self._seen_packets
+        self.overflows += 1
+        if self._overflow_flush:
+            ss = packets.ss[0]
+            es = packets.es[packets.length - 1]
+            self._forward_seen_packets()
+            if self._annotate:
+                self._put_gui(ss, es, ANN_WARNING, [f"{WARN}: transaction exceeded {packets.length} packets", f"{WARN}: overflow", "!"])
+            if self._log_level >= LOG_SUMMARY:
+                printErr(f"{ss}-{es}: {WARN} transaction exceeded {packets.length} packets")
+        self.reset()
+        self._bypass = True
+        self._bypass_forward = self._overflow_flush
+        self._overflowed = True
+
+    def _on_parse_error(self, ss, es, builder_name):
+        if self._stats is not None:
+            self._stats.parse_failures += 1
+        if self._log_level >= LOG_SUMMARY:
+            printErr(f"{ss}-{es}: {FAILED_MSG[0]} {builder_name}")
+        if self._trace is not None:
+            self._trace.dump(f"{FAILED_MSG[0]} at {ss}-{es}")
+
+    def dump_trace(self):
+        """Dump the trace ring buffer to stderr, requires the 'trace_buffer' option."""
+        if self._trace is not None:
+            self._trace.dump("requested")
 
     def _put_gui(self, ss, es, annotation_class_idx, text_list):
-        self.put(ss, es, self.out_ann, [annotation_class_idx, text_list])
+        # Texts may be shared cached tuples, hand out a list of our own.
+        self.put(ss, es, self.out_ann, [annotation_class_idx, list(text_list)])
 
     def _put_python(self, ss, es, data):
         self.put(ss, es, self.out_python, data)
 
-    def _get_cmd_index(self, cmd, packets) -> int:
-        first_idx = -1
-        for idx, value in enumerate(packets):
-            if value[2][0] == cmd:
-                first_idx = idx
-                break
-        return first_idx
-
-    def _forward_seen_packets(self):
-        for ss, es, data in self._seen_packets:
-            self._put_python(ss, es, data)
-
-
-# Quick and dirty state table.
-_state_machine = {
-    START: {
-        ADDR_WRITE: {
-            ACK: {
-                DATA_WRITE: {
-                    ACK: {
-                        DATA_WRITE: {
-                            ACK: {
-                                STOP: {
-                                    # Write to X register value V
-                                    "build_gui_text": "msg_write_to_register",
-                                },
-                                RESTART: {
-                                    # Write to X register value V
-                                    "build_gui_text": "msg_write_to_register",
-                                    ADDR_WRITE: {},
-                                    ADDR_READ: {},
-                                }
-                            },
-                            NACK: {
-                                STOP: {
-                                    # Write to X register value V
-                                    "build_gui_text": "msg_write_to_register",
-                                },
-                            },
-                        },
-                        RESTART: {
-                            "build_gui_text": "msg_set_register_as_read_from",
-                            ADDR_WRITE: {},
-                            ADDR_READ: {},
-                        },
-                        STOP: {
-                            # Set X register as register to read from.
-                            "build_gui_text": "msg_set_register_as_read_from",
-                        }
-                    },
-                    NACK: {},
-                },
-                DATA_READ: {},
-            },
-            NACK: {},
-        },
-        ADDR_READ: {
-            ACK: {
-                DATA_READ: {
-                    ACK: {
-                        STOP: {
-                            # Read from X register
-                            "build_gui_text": "msg_read_from_register",
-                        },
-                        RESTART: {
-                            # Read from X register
-                            "build_gui_text": "msg_read_from_register",
-                            ADDR_WRITE: {},
-                            ADDR_READ: {},
-                        },
-                    },
-                    NACK: {
-                        STOP: {
-                            # Read from X register
-                            "build_gui_text": "msg_read_from_register",
-                        },
-                        RESTART: {
-                            # Read from X register
-                            "build_gui_text": "msg_read_from_register",
-                            ADDR_WRITE: {},
-                            ADDR_READ: {},
-                        },
-                    },
-                }
-            },
-            NACK: {}
-        }
-    },
-    RESTART: {},
-    STOP: {
-        "build_gui_text": "msg_noop",
-    },
-}
+    def _put_event(self, ss, es, data):
+        self.put(ss, es, self.out_events, data)
+
+    def _forward_seen_packets(self, end: Optional[int] = None):
+        if self._timing:
+            t0 = time.perf_counter()
+            self._seen_packets.forward(self._put_python, end)
+            self._stats.output_seconds += time.perf_counter() - t0
+        else:
+            self._seen_packets.forward(self._put_python, end)
+
+
+# Compiled from the grammar in grammar.py, regenerate with
+# `python -m i2c_pca9534.grammar`. One row of next states per state,
+# columns in COMMANDS order: START, START REPEAT, STOP, ACK, NACK, ADDRESS READ, ADDRESS WRITE, DATA READ, DATA WRITE.
+TRANSITIONS = (
+    1, 1, 2, 0, 0, 0, 0, 0, 0,  # 0
+    27, 27, 1, 26, 26, 4, 3, 26, 26,  # 1
+    27, 27, 2, 2, 2, 2, 2, 2, 2,  # 2 msg_noop
+    27, 27, 3, 5, 5, 26, 26, 26, 26,  # 3
+    27, 27, 4, 6, 6, 26, 26, 26, 26,  # 4
+    27, 27, 5, 26, 26, 26, 26, 8, 7,  # 5
+    27, 27, 6, 26, 26, 26, 26, 9, 26,  # 6
+    27, 27, 7, 10, 11, 26, 26, 26, 26,  # 7
+    27, 27, 8, 8, 8, 8, 8, 8, 8,  # 8
+    27, 27, 9, 12, 13, 26, 26, 26, 26,  # 9
+    27, 15, 16, 26, 26, 26, 26, 26, 14,  # 10
+    27, 27, 11, 11, 11, 11, 11, 11, 11,  # 11
+    27, 18, 17, 12, 12, 12, 12, 12, 12,  # 12
+    27, 20, 19, 13, 13, 13, 13, 13, 13,  # 13
+    27, 27, 14, 21, 22, 26, 26, 26, 26,  # 14
+    27, 27, 15, 26, 26, 4, 3, 26, 26,  # 15 msg_set_register_as_read_from
+    27, 27, 16, 16, 16, 16, 16, 16, 16,  # 16 msg_set_register_as_read_from
+    27, 27, 17, 17, 17, 17, 17, 17, 17,  # 17 msg_read_from_register
+    27, 27, 18, 26, 26, 4, 3, 26, 26,  # 18 msg_read_from_register
+    27, 27, 19, 19, 19, 19, 19, 19, 19,  # 19 msg_read_from_register
+    27, 27, 20, 26, 26, 4, 3, 26, 26,  # 20 msg_read_from_register
+    27, 24, 23, 21, 21, 21, 21, 21, 21,  # 21
+    27, 27, 25, 22, 22, 22, 22, 22, 22,  # 22
+    27, 27, 23, 23, 23, 23, 23, 23, 23,  # 23 msg_write_to_register
+    27, 27, 24, 26, 26, 4, 3, 26, 26,  # 24 msg_write_to_register
+    27, 27, 25, 25, 25, 25, 25, 25, 25,  # 25 msg_write_to_register
+    1, 1, 26, 26, 26, 26, 26, 26, 26,  # 26 error
+)
+ERROR_STATE = 26
+RESYNC_STATE = 27  # Not a row, see mark_violations() in grammar.py
+STATE_BUILDERS = (
+    None,  # 0
+    None,  # 1
+    'msg_noop',  # 2
+    None,  # 3
+    None,  # 4
+    None,  # 5
+    None,  # 6
+    None,  # 7
+    None,  # 8
+    None,  # 9
+    None,  # 10
+    None,  # 11
+    None,  # 12
+    None,  # 13
+    None,  # 14
+    'msg_set_register_as_read_from',  # 15
+    'msg_set_register_as_read_from',  # 16
+    'msg_read_from_register',  # 17
+    'msg_read_from_register',  # 18
+    'msg_read_from_register',  # 19
+    'msg_read_from_register',  # 20
+    None,  # 21
+    None,  # 22
+    'msg_write_to_register',  # 23
+    'msg_write_to_register',  # 24
+    'msg_write_to_register',  # 25
+    None,  # 26
+)
+EARLY_BUILDERS = (
+    None,  # 0
+    None,  # 1
+    None,  # 2
+    None,  # 3
+    None,  # 4
+    None,  # 5
+    None,  # 6
+    None,  # 7
+    None,  # 8
+    None,  # 9
+    None,  # 10
+    None,  # 11
+    'msg_read_from_register',  # 12
+    'msg_read_from_register',  # 13
+    None,  # 14
+    None,  # 15
+    None,  # 16
+    None,  # 17
+    None,  # 18
+    None,  # 19
+    None,  # 20
+    'msg_write_to_register',  # 21
+    'msg_write_to_register',  # 22
+    None,  # 23
+    None,  # 24
+    None,  # 25
+    None,  # 26
+)
+POINTER_SENT = (
+    False,  # 0
+    False,  # 1
+    False,  # 2
+    False,  # 3
+    False,  # 4
+    False,  # 5
+    False,  # 6
+    True,  # 7
+    False,  # 8
+    False,  # 9
+    True,  # 10
+    True,  # 11
+    False,  # 12
+    False,  # 13
+    True,  # 14
+    False,  # 15
+    False,  # 16
+    False,  # 17
+    False,  # 18
+    False,  # 19
+    False,  # 20
+    True,  # 21
+    True,  # 22
+    False,  # 23
+    False,  # 24
+    False,  # 25
+    False,  # 26
+)
+
+
+ROOT_STATE = 0
+# Where a REPEATED START that ends a bypassed segment leaves the grammar.
+RESTART_STATE = TRANSITIONS[ROOT_STATE * N_COMMANDS + CMD_RESTART]
+# Per state, whether a slave address would open a segment: right after a
+# START or REPEATED START, or with no transaction in progress at all. Only
+# there is another slave's address the start of traffic to bypass, anywhere
+# else it goes through the grammar like any other stray packet.
+_OPENS_SEGMENT = tuple(
+    state == ROOT_STATE or TRANSITIONS[state * N_COMMANDS + CMD_ADDR_WRITE] == TRANSITIONS[RESTART_STATE * N_COMMANDS + CMD_ADDR_WRITE]
+    for state in range(ERROR_STATE + 1)
+)
+
+Decoder._bind_builders()
+
 
-_state_machine[RESTART] = _state_machine[START]
-_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_WRITE] = _state_machine[START][ADDR_WRITE]
-_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_READ] = _state_machine[START][ADDR_READ]
-_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_READ] = _state_machine[START][ADDR_READ]
-_state_machine[START][ADDR_WRITE][ACK][DATA_WRITE][ACK][RESTART][ADDR_WRITE] = _state_machine[START][ADDR_WRITE]
-_state_machine[START][ADDR_READ][ACK][DATA_READ][ACK][RESTART][ADDR_WRITE] = _state_machine[START][ADDR_WRITE]
-_state_machine[START][ADDR_READ][ACK][DATA_READ][ACK][RESTART][ADDR_READ] = _state_machine[START][ADDR_READ]
-_state_machine[START][ADDR_WRITE][NACK] = _state_machine[START][ADDR_WRITE][ACK]
-_state_machine[START][ADDR_READ][NACK] = _state_machine[START][ADDR_READ][ACK]
+def dump_grammar() -> List[str]:
+    """The compiled transition table, one line per state, for tests and debugging."""
+    lines = []
+    for state, builder in enumerate(STATE_BUILDERS):
+        row = TRANSITIONS[state * N_COMMANDS:(state + 1) * N_COMMANDS]
+        edges = ", ".join(f"{COMMANDS[cmd]} -> {nxt}" for cmd, nxt in enumerate(row) if nxt != state)
+        lines.append(f"{state:3d} [{builder or ''}] {edges}")
+    return lines
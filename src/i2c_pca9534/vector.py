@@ -0,0 +1,286 @@
+"""
+Vectorized bulk decode of i2c packets held in numpy arrays.
+
+Decoder.decode costs a Python call per packet. For offline analysis of
+packets that are already arrays (start/end sample, command code, byte value)
+decode_arrays() finds the transactions with whole-array operations instead
+and returns the same table as export.export_transactions(), one numpy array
+per export.COLUMNS column.
+
+Command codes are those of packet files, batch.FILE_COMMANDS, values are -1
+where the packet has none. A packet file can be mapped into such arrays
+with load_packet_arrays().
+
+The capture is cut into segments, each ending with a STOP. A segment is
+regular when it is START, one or more address phases separated by REPEATED
+STARTs, STOP, and every address phase of a decoded slave is the address,
+then data bytes of the matching direction, each followed by an ACK or NACK.
+That covers everything a healthy bus carries and is decoded in bulk,
+including register pointers carried from write to read per device. Any other
+segment (glitches, a capture starting or ending mid-transfer) is handed to
+the regular Decoder, seeded with the register pointers of the bulk part, so
+the result is identical to a packet by packet decode with `flush()` at the
+end.
+
+The bulk part covers parts whose register pointer sticks, such as the
+PCA9534. For parts that auto-increment everything goes through the Decoder.
+
+Requires numpy.
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .batch import _HEADER, FILE_COMMANDS, OUT_EVENTS, PACKET_FILE_MAGIC, PACKET_FILE_VERSION, create_decoder
+from .export import COLUMNS, DIRECTION_READ, DIRECTION_WRITE, TransactionWriter
+from .pd import CMD_ACK, CMD_ADDR_READ, CMD_ADDR_WRITE, CMD_DATA_READ, CMD_DATA_WRITE, CMD_NACK, CMD_RESTART, CMD_START, CMD_STOP, N_COMMANDS
+
+PACKET_DTYPE = np.dtype([("ss", "<u8"), ("es", "<u8"), ("cmd", "u1"), ("value", "<i2")])
+
+# Register of a pointer operation that makes the pointer unknown, and of a read through it
+_FORGET = -1
+
+
+def load_packet_arrays(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(ss, es, cmd, value) of a packet file, memory mapped."""
+    with open(path, "rb") as f:
+        magic, version = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != PACKET_FILE_MAGIC or version != PACKET_FILE_VERSION:
+        raise Exception(f"Not a PCA9534 packet file (magic {magic!r}, version {version})")
+    records = np.memmap(path, dtype=PACKET_DTYPE, mode="r", offset=_HEADER.size)
+    return records["ss"], records["es"], records["cmd"], records["value"]
+
+
+def decode_packet_file(path: str, options: Optional[Dict[str, object]] = None) -> Dict[str, np.ndarray]:
+    return decode_arrays(*load_packet_arrays(path), options=options)
+
+
+class _Phases:
+    """
+    Every address phase of the capture: opened by a START or REPEATED START
+    at packet `open`, closed by the next condition at packet `close`.
+    """
+
+    def __init__(self, cmd: np.ndarray, value: np.ndarray, conds: np.ndarray, ours: np.ndarray):
+        cond_cmd = cmd[conds]
+        k = np.flatnonzero((cond_cmd[:-1] == CMD_START) | (cond_cmd[:-1] == CMD_RESTART))
+        self.open = conds[k]
+        self.close = conds[k + 1]
+        self.length = self.close - self.open - 1  # Packets between the conditions
+
+        n = len(cmd)
+        has_addr = self.length >= 1
+        first = np.minimum(self.open + 1, n - 1)
+        addr_cmd = cmd[first]
+        self.write = addr_cmd == CMD_ADDR_WRITE
+        has_addr &= self.write | (addr_cmd == CMD_ADDR_READ)
+        self.address = (value[first] & 0x7F).astype(np.uint8)
+        self.ours = has_addr & ours[self.address]
+        self.has_addr = has_addr
+        self.data = np.maximum(self.length - 2, 0) // 2  # Data bytes
+
+
+def _gather(a: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """a[idx] with indices past the end clipped, for columns that are masked afterwards."""
+    return a[np.minimum(idx, len(a) - 1)]
+
+
+def _regular_segments(cmd: np.ndarray, conds: np.ndarray, phases: _Phases, max_packets: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(segment id per packet, per segment True when it can be decoded in bulk)."""
+    n = len(cmd)
+    is_stop = cmd == CMD_STOP
+    segment = np.cumsum(is_stop) - is_stop  # STOPs before each packet
+    n_segments = int(segment[-1]) + 1
+    bad = np.zeros(n_segments, dtype=bool)
+
+    if not is_stop[-1]:
+        bad[-1] = True  # Ends mid-transfer
+
+    # Conditions must come as START (REPEATED START)* STOP with the START right after the previous STOP.
+    cond_cmd = cmd[conds]
+    prev_cmd = np.empty_like(cond_cmd)
+    prev_cmd[0] = CMD_STOP
+    prev_cmd[1:] = cond_cmd[:-1]
+    prev_at = np.empty_like(conds)
+    prev_at[0] = -1
+    prev_at[1:] = conds[:-1]
+    after_stop = prev_cmd == CMD_STOP
+    ok = np.where(cond_cmd == CMD_START, after_stop & (prev_at == conds - 1), ~after_stop)
+    bad[segment[conds[~ok]]] = True
+
+    # Address phases of decoded slaves: address, ACK/NACK, then data bytes of the
+    # address direction each followed by an ACK/NACK. Other slaves are bypassed
+    # whole once their address is seen.
+    body = np.ones(n, dtype=bool)
+    body[conds] = False
+    phase_of = np.cumsum((cmd == CMD_START) | (cmd == CMD_RESTART)) - 1
+    in_phase = body & (phase_of >= 0)
+    idx = np.flatnonzero(in_phase)
+    # Packets past the last closed phase belong to a bad segment anyway.
+    idx = idx[phase_of[idx] < len(phases.open)]
+    ph = phase_of[idx]
+    pos = idx - phases.open[ph] - 1
+    c = cmd[idx]
+    data_cmd = np.where(phases.write[ph], CMD_DATA_WRITE, CMD_DATA_READ)
+    expected = np.where(
+        pos == 0,
+        (c == CMD_ADDR_WRITE) | (c == CMD_ADDR_READ),
+        np.where(pos % 2 == 1, (c == CMD_ACK) | (c == CMD_NACK), c == data_cmd),
+    )
+    wrong = np.zeros(len(phases.open), dtype=bool)
+    wrong[ph[~expected]] = True
+
+    phase_ok = phases.has_addr & (
+        ~phases.ours | (~wrong & (phases.length >= 2) & (phases.length % 2 == 0) & (phases.length + 1 < max_packets))
+    )
+    bad[segment[phases.open[~phase_ok]]] = True
+    return segment, ~bad
+
+
+class _Bulk:
+    """
+    Messages of the address phases `sel` (indices into `phases`, all in
+    regular segments, in capture order), with the register pointer of reads
+    still to be resolved.
+    """
+
+    def __init__(self, cmd: np.ndarray, value: np.ndarray, phases: _Phases, sel: np.ndarray):
+        o = self.open = phases.open[sel]
+        close_sr = cmd[phases.close[sel]] == CMD_RESTART
+        ours = phases.ours[sel]
+        write = phases.write[sel]
+        n = phases.data[sel]
+        self.address = phases.address[sel]
+        self.ack1 = _gather(cmd, o + 4) == CMD_ACK
+        self.ack2 = _gather(cmd, o + 6) == CMD_ACK
+
+        self.pointer_write = ours & write & (n == 1) & self.ack1
+        self.register_write = ours & write & (n >= 2) & self.ack1
+        self.read = ours & ~write & (n >= 1)
+        sets = self.pointer_write | self.register_write
+        self.op = sets | (ours & write & (n >= 1) & close_sr & ~self.ack1)
+        self.op_reg = np.where(sets, _gather(value, o + 3), _FORGET)
+
+    def ops(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(packet index, address, register or _FORGET) of the pointer operations."""
+        i = np.flatnonzero(self.op)
+        return self.open[i], self.address[i], self.op_reg[i]
+
+    def columns(self, ss, es, value, op_pos, op_addr, op_reg) -> Dict[str, np.ndarray]:
+        """
+        Output columns, reads take the register of the last of the pointer
+        operations (op_pos, op_addr, op_reg) of their address before them.
+        """
+        reads = np.flatnonzero(self.read)
+        pos = np.concatenate((op_pos, self.open[reads]))
+        addr = np.concatenate((op_addr, self.address[reads]))
+        is_op = np.arange(len(pos)) < len(op_pos)
+        order = np.lexsort((pos, addr))  # By address, then capture order
+        last_op = np.maximum.accumulate(np.where(is_op[order], np.arange(len(order)), -1))
+        prev = order[np.maximum(last_op, 0)]
+        same = (last_op >= 0) & (addr[prev] == addr[order])
+        resolved = np.empty(len(pos), dtype=np.int64)
+        resolved[order] = np.where(same, np.concatenate((op_reg, np.zeros(len(reads), dtype=np.int64)))[prev], _FORGET)
+        read_reg = np.full(len(self.open), _FORGET, dtype=np.int64)
+        read_reg[reads] = resolved[len(op_pos):]
+
+        register_write = self.register_write
+        row = np.flatnonzero(self.pointer_write | register_write | self.read)
+        po = self.open[row]
+        is_read = self.read[row]
+        is_register_write = register_write[row]
+        return {
+            "ss": ss[po + 1],
+            "es": es[np.where(is_register_write, po + 6, po + 4)],
+            "address": self.address[row],
+            "direction": np.where(is_read, DIRECTION_READ, DIRECTION_WRITE),
+            "register": np.where(is_read, read_reg[row], value[po + 3]),
+            "value": np.where(is_read, value[po + 3], np.where(is_register_write, _gather(value, po + 5), -1)),
+            "ack": np.where(is_register_write, self.ack2[row], self.ack1[row]),
+        }
+
+
+def _np_type(npy_type: str) -> np.dtype:
+    return np.dtype(("|" if npy_type.endswith("1") else "<") + npy_type)
+
+
+def decode_arrays(
+    ss: np.ndarray, es: np.ndarray, cmd: np.ndarray, value: np.ndarray, options: Optional[Dict[str, object]] = None
+) -> Dict[str, np.ndarray]:
+    """The export_transactions() table of the packets given as arrays."""
+    ss = np.asarray(ss)
+    es = np.asarray(es)
+    cmd = np.asarray(cmd)
+    value = np.asarray(value).astype(np.int64)
+    scalar = TransactionWriter()
+    decoder = create_decoder(None, options, lambda output_id, s, e, data: scalar.add_event(s, e, data) if output_id == OUT_EVENTS else None)
+    addresses = decoder.addresses()
+    if not len(cmd):
+        return {name: np.zeros(0, dtype=_np_type(npy_type)) for name, _, npy_type in COLUMNS}
+    if cmd.max() >= N_COMMANDS:
+        raise Exception(f"Unknown command code {cmd.max()}")
+
+    ours = np.zeros(128, dtype=bool)
+    ours[addresses] = True
+    conds = np.flatnonzero((cmd == CMD_START) | (cmd == CMD_RESTART) | (cmd == CMD_STOP))
+    if not len(conds):
+        conds = np.array([len(cmd) - 1])  # Not a condition, the lone segment is irregular
+    phases = _Phases(cmd, value, conds, ours)
+    segment, regular = _regular_segments(cmd, conds, phases, decoder.max_packets)
+    if decoder.model.auto_increment:
+        regular[:] = False  # Bursts and pointers that move on every byte, decoded by the fallback only
+    bulk = _Bulk(cmd, value, phases, np.flatnonzero(regular[segment[phases.open]]))
+    op_pos, op_addr, op_reg = bulk.ops()
+
+    # Runs of irregular segments go through the decoder, in order, each seeded
+    # with the register pointers left by the bulk part and the previous run.
+    # What a run leaves becomes a pointer operation at its last packet.
+    seg_start = np.concatenate(([0], np.flatnonzero(cmd == CMD_STOP) + 1))
+    bounds = np.flatnonzero(np.diff(np.concatenate(([True], regular, [True])).astype(np.int8)))
+    begins = seg_start[bounds[0::2]]
+    ends = np.append(seg_start, len(cmd))[bounds[1::2]]
+    by_device = []
+    for address in addresses:
+        mine = op_addr == address
+        pos = op_pos[mine]
+        by_device.append((address, pos, op_reg[mine], np.searchsorted(pos, begins) - 1))
+    pointers = {address: _FORGET for address in addresses}
+    left_pos, left_addr, left_reg = [], [], []
+    scalar_rows = []
+    previous_end = 0
+    decode = decoder.decode
+    for r, (begin, end) in enumerate(zip(begins.tolist(), ends.tolist())):
+        for address, pos, regs, last in by_device:
+            j = last[r]
+            if j >= 0 and pos[j] >= previous_end:
+                pointers[address] = int(regs[j])
+            decoder.set_register_pointer(address, None if pointers[address] == _FORGET else pointers[address])
+        rows = len(scalar)
+        for s, e, c, v in zip(ss[begin:end].tolist(), es[begin:end].tolist(), cmd[begin:end].tolist(), value[begin:end].tolist()):
+            decode(s, e, [FILE_COMMANDS[c], None if v < 0 else v])
+        if end == len(cmd):
+            decoder.flush()
+        for address in addresses:
+            reg = decoder.register_pointer(address)
+            pointers[address] = _FORGET if reg is None else reg
+            left_pos.append(end - 1)
+            left_addr.append(address)
+            left_reg.append(pointers[address])
+        scalar_rows.append(len(scalar) - rows)
+        previous_end = end
+
+    columns = bulk.columns(
+        ss, es, value,
+        np.concatenate((op_pos, np.array(left_pos, dtype=op_pos.dtype))),
+        np.concatenate((op_addr, np.array(left_addr, dtype=op_addr.dtype))),
+        np.concatenate((op_reg, np.array(left_reg, dtype=np.int64))),
+    )
+    # Both parts are in capture order, interleave them by the packet they start at.
+    key = np.concatenate((bulk.open[bulk.pointer_write | bulk.register_write | bulk.read], np.repeat(begins, scalar_rows)))
+    order = np.argsort(key, kind="stable")
+    fallback = scalar.columns()
+    return {
+        name: np.concatenate((columns[name], np.frombuffer(fallback[name], dtype=fallback[name].typecode))).astype(_np_type(npy_type))[order]
+        for name, _, npy_type in COLUMNS
+    }
@@ -0,0 +1,141 @@
+"""
+Synthetic i2c traffic shared by the tests, packets shaped like the output of
+the i2c decoder: (start_sample, end_sample, [cmd, value]).
+"""
+
+import random
+
+from i2c_pca9534.pd import ACK, ADDR_READ, ADDR_WRITE, CONFIG_REG, DATA_READ, DATA_WRITE, INPUT_REG, NACK, OUTPUT_REG, RESTART, START, STOP
+
+BYTE_SAMPLES = 80  # 8 clocks at 10 samples per bit, the ACK/NACK takes the 9th
+EDGE_SAMPLES = 10
+
+
+class Bus:
+    """Builds packets with consecutive sample numbers, optionally preceding every byte with its 'BITS'."""
+
+    def __init__(self, bits: bool = False):
+        self.sample = 0
+        self.bits = bits
+
+    def condition(self, cmd):
+        ss = self.sample
+        self.sample += EDGE_SAMPLES
+        return ss, self.sample - 1, [cmd, None]
+
+    def byte(self, cmd, value, ack=None):
+        """A byte and its ACK, NACK for a read unless `ack` says otherwise."""
+        ss = self.sample
+        es = ss + BYTE_SAMPLES - 1
+        packets = []
+        if self.bits:
+            step = BYTE_SAMPLES // 8
+            packets.append((ss, es, ["BITS", [[(value >> i) & 1, ss + (7 - i) * step, ss + (8 - i) * step] for i in range(8)]]))
+        packets.append((ss, es, [cmd, value]))
+        self.sample = es + 1
+        packets.append(self.condition(ack or (NACK if cmd == DATA_READ else ACK)))
+        return packets
+
+    def pointer_write(self, address, reg):
+        return [self.condition(START), *self.byte(ADDR_WRITE, address), *self.byte(DATA_WRITE, reg), self.condition(STOP)]
+
+    def register_write(self, address, reg, value):
+        return [self.condition(START), *self.byte(ADDR_WRITE, address), *self.byte(DATA_WRITE, reg), *self.byte(DATA_WRITE, value), self.condition(STOP)]
+
+    def restart_read(self, address, reg, value):
+        return [
+            self.condition(START), *self.byte(ADDR_WRITE, address), *self.byte(DATA_WRITE, reg),
+            self.condition(RESTART), *self.byte(ADDR_READ, address), *self.byte(DATA_READ, value), self.condition(STOP),
+        ]
+
+    def read(self, address, value):
+        return [self.condition(START), *self.byte(ADDR_READ, address), *self.byte(DATA_READ, value), self.condition(STOP)]
+
+
+def mixed(n, seed, addresses=(0x20, 0x21), foreign=(0x50, 0x51, 0x68), foreign_ratio=0.2):
+    """Every PCA9534 transaction shape for `addresses`, with register writes to `foreign` slaves interleaved."""
+    rnd = random.Random(seed)
+    bus = Bus()
+    packets = []
+    for _ in range(n):
+        if rnd.random() < foreign_ratio:
+            packets += bus.register_write(rnd.choice(foreign), rnd.randrange(256), rnd.randrange(256))
+            continue
+        address = rnd.choice(addresses)
+        shape = rnd.randrange(4)
+        if shape == 0:
+            packets += bus.pointer_write(address, rnd.randrange(CONFIG_REG + 1))
+        elif shape == 1:
+            packets += bus.register_write(address, rnd.randrange(OUTPUT_REG, CONFIG_REG + 1), rnd.randrange(256))
+        elif shape == 2:
+            packets += bus.restart_read(address, INPUT_REG, rnd.randrange(256))
+        else:
+            packets += bus.read(address, rnd.randrange(256))
+    return packets
+
+
+def pca9555(n, seed, addresses=(0x20, 0x21)):
+    """Pointer writes, burst writes and burst reads with and without a repeated start, on 16 bit expanders."""
+    rnd = random.Random(seed)
+    bus = Bus()
+    packets = []
+
+    def burst_read():
+        count = rnd.randrange(1, 4)
+        for i in range(count):
+            packets.extend(bus.byte(DATA_READ, rnd.randrange(256), ACK if i < count - 1 else NACK))
+
+    for _ in range(n):
+        address = rnd.choice(addresses)
+        shape = rnd.randrange(4)
+        packets.append(bus.condition(START))
+        packets.extend(bus.byte(ADDR_WRITE if shape < 3 else ADDR_READ, address))
+        if shape == 0:
+            packets.extend(bus.byte(DATA_WRITE, rnd.randrange(8)))
+        elif shape == 1:
+            packets.extend(bus.byte(DATA_WRITE, rnd.randrange(2, 8)))
+            for _ in range(rnd.randrange(1, 4)):
+                packets.extend(bus.byte(DATA_WRITE, rnd.randrange(256)))
+        elif shape == 2:
+            packets.extend(bus.byte(DATA_WRITE, rnd.randrange(8)))
+            packets.append(bus.condition(RESTART))
+            packets.extend(bus.byte(ADDR_READ, address))
+            burst_read()
+        else:
+            burst_read()
+        packets.append(bus.condition(STOP))
+    return packets
+
+
+def glitched(packets, seed):
+    """`packets` with some ACKs and STOPs lost and stray STARTs and repeated starts added."""
+    rnd = random.Random(seed)
+    out = []
+    for packet in packets:
+        r = rnd.random()
+        if packet[2][0] in (ACK, NACK, STOP) and r < 0.01:
+            continue
+        out.append(packet)
+        if r > 0.995:
+            out.append((packet[1], packet[1], [START, None]))
+        elif 0.99 < r < 0.992:
+            out.append((packet[1], packet[1], [RESTART, None]))
+    return out
+
+
+SEEDS = range(3)
+TRANSACTIONS = 1500
+TRAFFIC = ("pca9534", "pca9534-glitched", "pca9555", "pca9555-glitched")
+
+
+def traffic(name, seed):
+    """(packets, decoder options) of a named TRAFFIC mix."""
+    if name.startswith("pca9534"):
+        packets = mixed(TRANSACTIONS, seed)
+        options = {"addresses": "0x20,0x21"}
+    else:
+        packets = pca9555(TRANSACTIONS, seed)
+        options = {"addresses": "0x20,0x21", "device": "PCA9555"}
+    if name.endswith("glitched"):
+        packets = glitched(packets, seed)
+    return packets, options
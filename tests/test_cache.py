@@ -0,0 +1,154 @@
+"""DecodeCache keys, lookups and eviction, in a throwaway cache directory."""
+
+import os
+import shutil
+
+import pytest
+from conftest import Bus, mixed
+
+np = pytest.importorskip("numpy")
+
+# pylint: disable=wrong-import-position
+from i2c_pca9534 import batch, cache, export  # noqa: E402
+from i2c_pca9534.cache import DecodeCache, _key_options  # noqa: E402
+from i2c_pca9534.pd import OUTPUT_REG  # noqa: E402
+
+OPTIONS = {"addresses": "0x20,0x21"}
+
+
+def _packets(value):
+    """A register write whose packets differ by `value` only, so all entries have one size."""
+    return Bus().register_write(0x20, OUTPUT_REG, value)
+
+
+def _tmp_dirs(directory):
+    return [name for name in os.listdir(directory) if name.startswith(cache._TMP_PREFIX)]
+
+
+def _assert_same_columns(columns, expected):
+    assert columns.keys() == expected.keys()
+    for name, column in expected.items():
+        assert np.array_equal(columns[name], column), name
+
+
+def test_key_options_normalized():
+    # The number as text or as int, 'address' or a one address 'addresses'
+    assert _key_options({"address": "32"}) == _key_options({"address": 32}) == _key_options({"addresses": "0x20"}) == _key_options(None)
+    assert _key_options({"addresses": "0x21,0x20,0x20"}) == _key_options({"addresses": "0x20-0x21"})
+    # Options that leave the table alone
+    assert _key_options({"annotations": "no", "streaming": "yes", "log_level": "trace", "other_traffic": "drop"}) == _key_options(None)
+    # and some that do not
+    assert _key_options({"address": 0x21}) != _key_options(None)
+    assert _key_options({"device": "pca9555"}) != _key_options(None)
+
+
+def test_key_same_for_file_and_sequence(tmp_path):
+    packets = mixed(50, 0)
+    path = str(tmp_path / "capture.pkt")
+    batch.write_packets(path, packets)
+    decode_cache = DecodeCache(str(tmp_path / "cache"))
+
+    assert decode_cache.key(path, OPTIONS) == decode_cache.key(packets, OPTIONS)
+    assert decode_cache.key(packets, {"addresses": "0x21,0x20"}) == decode_cache.key(packets, OPTIONS)
+    assert decode_cache.key(packets, {"addresses": "0x20"}) != decode_cache.key(packets, OPTIONS)
+    assert decode_cache.key(packets[:-1], OPTIONS) != decode_cache.key(packets, OPTIONS)
+
+
+def test_hits_and_misses(tmp_path):
+    packets = mixed(200, 0)
+    path = str(tmp_path / "capture.pkt")
+    batch.write_packets(path, packets)
+    export.export_transactions(packets, str(tmp_path / "expected"), OPTIONS)
+    expected = export.load_transactions(str(tmp_path / "expected"), mmap=False)
+    decode_cache = DecodeCache(str(tmp_path / "cache"))
+
+    _assert_same_columns(decode_cache.transactions(packets, OPTIONS), expected)
+    assert (decode_cache.hits, decode_cache.misses) == (0, 1)
+
+    _assert_same_columns(decode_cache.transactions(path, OPTIONS), expected)
+    _assert_same_columns(decode_cache.transactions(packets, {"addresses": "0x21,0x20", "annotations": "no"}), expected)
+    assert (decode_cache.hits, decode_cache.misses) == (2, 1)
+
+    decode_cache.transactions(packets, {"addresses": "0x20"})
+    assert (decode_cache.hits, decode_cache.misses) == (2, 2)
+    assert _tmp_dirs(decode_cache.directory) == []
+
+
+def test_fingerprint_invalidates(tmp_path, monkeypatch):
+    packets = _packets(0x55)
+    decode_cache = DecodeCache(str(tmp_path))
+    decode_cache.transactions(packets)
+    key = decode_cache.key(packets)
+
+    monkeypatch.setattr(cache, "CACHE_FORMAT_VERSION", cache.CACHE_FORMAT_VERSION + 1)
+    monkeypatch.setattr(cache, "_fingerprint", None)
+
+    assert decode_cache.key(packets) != key
+    decode_cache.transactions(packets)
+    assert (decode_cache.hits, decode_cache.misses) == (0, 2)
+
+
+def test_evict_least_recently_used(tmp_path):
+    decode_cache = DecodeCache(str(tmp_path))
+    keys = []
+    for used, value in enumerate((1, 2, 3), start=1):
+        decode_cache.transactions(_packets(value))
+        key = decode_cache.key(_packets(value))
+        os.utime(os.path.join(decode_cache.directory, key), (used * 1000, used * 1000))
+        keys.append(key)
+    oldest, middle, newest = keys
+    entry_bytes = decode_cache.size() // 3
+
+    # The oldest entry is kept, the next oldest goes instead
+    decode_cache.max_bytes = 2 * entry_bytes
+    decode_cache.evict(keep=oldest)
+    assert sorted(os.listdir(decode_cache.directory)) == sorted([cache._LOCK_FILE, oldest, newest])
+
+    decode_cache.max_bytes = entry_bytes
+    decode_cache.evict()
+    assert sorted(os.listdir(decode_cache.directory)) == sorted([cache._LOCK_FILE, newest])
+    assert middle not in os.listdir(decode_cache.directory)
+
+
+def test_evict_stale_tmp(tmp_path):
+    decode_cache = DecodeCache(str(tmp_path))
+    stale = tmp_path / f"{cache._TMP_PREFIX}stale"
+    fresh = tmp_path / f"{cache._TMP_PREFIX}fresh"
+    stale.mkdir()
+    fresh.mkdir()
+    os.utime(stale, (0, 0))
+
+    decode_cache.evict()
+
+    assert sorted(_tmp_dirs(decode_cache.directory)) == [fresh.name]
+
+
+def test_rename_race(tmp_path, monkeypatch):
+    packets = mixed(50, 1)
+    export.export_transactions(packets, str(tmp_path / "expected"), OPTIONS)
+    expected = export.load_transactions(str(tmp_path / "expected"), mmap=False)
+    decode_cache = DecodeCache(str(tmp_path / "cache"))
+    rename = os.rename
+
+    def store_first(src, dst):
+        # Another worker renames its entry into place just before us
+        shutil.copytree(src, dst)
+        rename(src, dst)
+
+    monkeypatch.setattr(cache.os, "rename", store_first)
+    _assert_same_columns(decode_cache.transactions(packets, OPTIONS), expected)
+    assert (decode_cache.hits, decode_cache.misses) == (0, 1)
+    assert _tmp_dirs(decode_cache.directory) == []
+
+
+def test_rename_failure(tmp_path, monkeypatch):
+    decode_cache = DecodeCache(str(tmp_path))
+
+    def fail(src, dst):
+        raise PermissionError(dst)
+
+    monkeypatch.setattr(cache.os, "rename", fail)
+    with pytest.raises(PermissionError):
+        decode_cache.transactions(_packets(1))
+    assert _tmp_dirs(decode_cache.directory) == []
+    assert decode_cache.size() == 0
@@ -0,0 +1,206 @@
+"""
+decode_capture() on small synthetic logic captures, raw and session files,
+against decode_packets() of the i2c decoder run sample by sample.
+"""
+
+import configparser
+import io
+import zipfile
+
+import pytest
+
+np = pytest.importorskip("numpy")
+srd = pytest.importorskip("sigrokdecode")
+
+# pylint: disable=wrong-import-position
+from i2c_pca9534 import batch, capture  # noqa: E402
+from i2c_pca9534.pd import DIR_READ, DIR_WRITE, INPUT_REG, OUTPUT_REG, TRANSACTION  # noqa: E402
+
+HALF_BIT = 5  # Samples per half SCL period
+OPTIONS = {"addresses": "0x20,0x21"}
+# Small odd sizes so that edges, bytes and conditions land on both sides of a chunk boundary
+CHUNK_SAMPLES = (1, 7, 97, capture.CHUNK_SAMPLES)
+
+
+class Waveform:
+    """SCL and SDA levels, one (scl, sda) per sample, of an i2c master driving the bus."""
+
+    def __init__(self):
+        self.levels = []
+        self.scl = self.sda = 1
+        self.idle(20)
+
+    def _set(self, scl, sda, samples=HALF_BIT):
+        self.scl, self.sda = scl, sda
+        self.levels += [(scl, sda)] * samples
+
+    def idle(self, samples):
+        self._set(1, 1, samples)
+
+    def start(self):
+        if not self.scl:  # Repeated start
+            self._set(0, 1)
+            self._set(1, 1)
+        self._set(1, 0)
+        self._set(0, 0)
+
+    def stop(self):
+        self._set(0, 0)
+        self._set(1, 0)
+        self._set(1, 1)
+
+    def bit(self, value):
+        self._set(0, value)
+        self._set(1, value)
+        self._set(0, value)
+
+    def byte(self, value, ack=True):
+        for i in range(7, -1, -1):
+            self.bit((value >> i) & 1)
+        self.bit(0 if ack else 1)
+
+    def write(self, address, *data):
+        self.start()
+        self.byte(address << 1)
+        for value in data:
+            self.byte(value)
+        self.stop()
+
+    def write_read(self, address, reg, value):
+        self.start()
+        self.byte(address << 1)
+        self.byte(reg)
+        self.start()
+        self.byte(address << 1 | 1)
+        self.byte(value, ack=False)
+        self.stop()
+
+    def samples(self, scl_bit, sda_bit, noise_bit=None):
+        levels = np.array(self.levels, dtype=np.uint8)
+        samples = (levels[:, 0] << scl_bit) | (levels[:, 1] << sda_bit)
+        if noise_bit is not None:
+            # A line the decode must ignore, toggling every sample
+            samples |= (np.arange(len(samples)) & 1).astype(np.uint8) << noise_bit
+        return samples
+
+
+def _waveform():
+    wave = Waveform()
+    wave.write(0x20, OUTPUT_REG, 0x5A)
+    wave.idle(1000)
+    wave.write(0x50, 0x10, 0xFF)  # Another slave
+    wave.write_read(0x20, INPUT_REG, 0xA5)
+    wave.idle(3)
+    wave.write(0x21, OUTPUT_REG, 0x0F)
+    wave.idle(20)
+    return wave
+
+
+class _SampleInput:
+    """The libsigrokdecode input for the i2c decoder, matching every condition one sample at a time."""
+
+    def __init__(self, lines):
+        self.samplenum = -1
+        self.matched = []
+        self._lines = [int(v) for v in lines]
+
+    def wait(self, conds):
+        last = self._lines[self.samplenum] if self.samplenum >= 0 else self._lines[0]
+        for sample in range(self.samplenum + 1, len(self._lines)):
+            value = self._lines[sample]
+            matched = [
+                sample == self.samplenum + c["skip"] if "skip" in c else srd.cond_matches(c, last, value) for c in conds
+            ] or [True]
+            if any(matched):
+                self.samplenum = sample
+                self.matched = matched
+                return value & 1, value >> 1
+            last = value
+        raise EOFError()
+
+
+def _expected(wave):
+    """decode_packets() of the i2c packets of `wave`."""
+    packets = []
+    i2c_class = capture._i2c_decoder_class()
+    i2c = i2c_class()
+    i2c.options = {o["id"]: o["default"] for o in i2c_class.options}
+    i2c.set_channelnum("scl", 0)
+    i2c.set_channelnum("sda", 1)
+    i2c.add_callback(srd.OUTPUT_PYTHON, None, lambda ss, es, data: packets.append((ss, es, data)))
+    i2c.reset()
+    i2c.start()
+    i2c.run(_SampleInput(wave.samples(0, 1)))
+    i2c.stop()
+
+    expected = batch.decode_packets(packets, OPTIONS)
+    assert [fields for _, _, (kind, fields) in expected.events() if kind == TRANSACTION] == [
+        (0x20, DIR_WRITE, OUTPUT_REG, 0x5A, True),
+        (0x20, DIR_WRITE, INPUT_REG, None, True),
+        (0x20, DIR_READ, INPUT_REG, 0xA5, False),
+        (0x21, DIR_WRITE, OUTPUT_REG, 0x0F, True),
+    ]
+    return expected
+
+
+def _assert_same_result(result, expected):
+    assert list(result.annotations()) == list(expected.annotations())
+    assert list(result.events()) == list(expected.events())
+    assert list(result.python()) == list(expected.python())
+
+
+def _write_session(path, samples, compression, members=2):
+    """A session file with the samples split over `members` logic members."""
+    metadata = configparser.ConfigParser()
+    metadata["global"] = {"sigrok version": "0.5.2"}
+    metadata["device 1"] = {
+        "capturefile": "logic-1",
+        "total probes": "8",
+        "samplerate": "1 MHz",
+        "total analog": "0",
+        "probe1": "SCL",
+        "probe2": "SDA",
+        "probe8": "NOISE",
+        "unitsize": "1",
+    }
+    text = io.StringIO()
+    metadata.write(text)
+    with zipfile.ZipFile(path, "w", compression) as zf:
+        zf.writestr("version", "2")
+        zf.writestr("metadata", text.getvalue())
+        for i, part in enumerate(np.array_split(samples, members), start=1):
+            zf.writestr(f"logic-1-{i}", part.tobytes())
+
+
+@pytest.mark.parametrize("chunk_samples", CHUNK_SAMPLES)
+def test_decode_raw(chunk_samples, tmp_path):
+    wave = _waveform()
+    path = tmp_path / "capture.raw"
+    path.write_bytes(wave.samples(scl_bit=5, sda_bit=2, noise_bit=0).tobytes())
+
+    result = capture.decode_capture(capture.RawLogic(str(path)), OPTIONS, scl=5, sda=2, chunk_samples=chunk_samples)
+
+    _assert_same_result(result, _expected(wave))
+
+
+@pytest.mark.parametrize("chunk_samples", CHUNK_SAMPLES)
+@pytest.mark.parametrize("compression", (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED))
+def test_decode_session(compression, chunk_samples, tmp_path):
+    wave = _waveform()
+    path = str(tmp_path / "capture.sr")
+    _write_session(path, wave.samples(scl_bit=0, sda_bit=1, noise_bit=7), compression)
+
+    session = capture.SessionFile(path)
+    assert (session.samplerate, session.unitsize, session.channels) == (1000000, 1, {0: "SCL", 1: "SDA", 7: "NOISE"})
+
+    result = capture.decode_capture(path, OPTIONS, chunk_samples=chunk_samples)
+
+    _assert_same_result(result, _expected(wave))
+
+
+def test_unknown_channel(tmp_path):
+    path = str(tmp_path / "capture.sr")
+    _write_session(path, _waveform().samples(0, 1), zipfile.ZIP_STORED)
+
+    with pytest.raises(Exception, match="No channel 'SDA1'"):
+        capture.decode_capture(path, OPTIONS, sda="SDA1")
@@ -0,0 +1,273 @@
+"""Decoder core behaviour, on packets shaped like the output of the i2c decoder."""
+
+from conftest import Bus
+
+from i2c_pca9534 import batch
+from i2c_pca9534.pd import (
+    ACK,
+    ADDR_WRITE,
+    ANN_STATS,
+    CONFIG_REG,
+    DATA_WRITE,
+    DIR_READ,
+    DIR_WRITE,
+    INPUT_REG,
+    NACK,
+    OTHER_DROP,
+    OTHER_FORWARD,
+    OUTPUT_REG,
+    PIN_CHANGE,
+    POLARITY_REG,
+    REPORT_ANNOTATION,
+    START,
+    STATS_COUNTS,
+    STOP,
+    TRANSACTION,
+)
+
+
+def decode(packets, **options):
+    return batch.decode_packets(list(packets), options)
+
+
+def messages(result):
+    """The long text of every transaction annotation."""
+    return [text[0] for _, _, _, text in result.annotations() if text[0].startswith("PCA9534")]
+
+
+def events(result, kind):
+    return [fields for _, _, (k, fields) in result.events() if k == kind]
+
+
+def test_register_write():
+    result = decode(Bus().register_write(0x20, OUTPUT_REG, 0x5A))
+
+    assert messages(result) == ["PCA9534 at 0x20: Output pins pull up/down set to 0b01011010"]
+    assert events(result, TRANSACTION) == [(0x20, DIR_WRITE, OUTPUT_REG, 0x5A, True)]
+    # The output register powers on as 0xff
+    assert events(result, PIN_CHANGE) == [(0x20, OUTPUT_REG, pin, 1, 0) for pin in (0, 2, 5, 7)]
+
+
+def test_register_write_span():
+    bus = Bus()
+    packets = list(bus.register_write(0x20, CONFIG_REG, 0x0F))
+    result = decode(packets)
+
+    (ss, es, _), = [e for e in result.events() if e[2][0] == TRANSACTION]
+    assert (ss, es) == (packets[1][0], packets[-2][1])  # Address byte to the last ACK
+
+
+def test_pointer_write():
+    result = decode(Bus().pointer_write(0x20, CONFIG_REG))
+
+    assert messages(result) == ["PCA9534 at 0x20: set to read from Config register"]
+    assert events(result, TRANSACTION) == [(0x20, DIR_WRITE, CONFIG_REG, None, True)]
+    assert events(result, PIN_CHANGE) == []
+
+
+def test_pointer_read():
+    bus = Bus()
+    result = decode([*bus.pointer_write(0x20, INPUT_REG), *bus.read(0x20, 0x81)])
+
+    assert messages(result) == [
+        "PCA9534 at 0x20: set to read from Input register",
+        "PCA9534 at 0x20: Read data 0x81 from Input register",
+    ]
+    assert events(result, TRANSACTION)[1] == (0x20, DIR_READ, INPUT_REG, 0x81, False)
+    # Input pins have no power on value, the first read reports all of them
+    assert events(result, PIN_CHANGE) == [(0x20, INPUT_REG, pin, None, (0x81 >> pin) & 1) for pin in range(8)]
+
+
+def test_read_follows_register_write():
+    bus = Bus()
+    result = decode([*bus.register_write(0x20, POLARITY_REG, 0x01), *bus.read(0x20, 0x01)])
+
+    assert messages(result)[1] == "PCA9534 at 0x20: Read data 0x1 from Polarity register"
+
+
+def test_restart_read():
+    result = decode(Bus().restart_read(0x20, CONFIG_REG, 0xF0))
+
+    assert messages(result) == [
+        "PCA9534 at 0x20: set to read from Config register",
+        "PCA9534 at 0x20: Read data 0xf0 from Config register",
+    ]
+    assert ["Start repeat", "Sr"] in [text for _, _, _, text in result.annotations()]
+    assert events(result, TRANSACTION) == [(0x20, DIR_WRITE, CONFIG_REG, None, True), (0x20, DIR_READ, CONFIG_REG, 0xF0, False)]
+    assert events(result, PIN_CHANGE) == [(0x20, CONFIG_REG, pin, 1, 0) for pin in range(4)]
+
+
+def test_data_nack():
+    bus = Bus()
+    packets = [bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, OUTPUT_REG), *bus.byte(DATA_WRITE, 0xF0, NACK), bus.condition(STOP)]
+    result = decode(packets)
+
+    assert messages(result) == ["PCA9534 at 0x20: Output pins pull up/down set to 0b11110000"]
+    assert events(result, TRANSACTION) == [(0x20, DIR_WRITE, OUTPUT_REG, 0xF0, False)]
+
+
+def test_address_nack():
+    bus = Bus()
+    packets = [bus.condition(START), *bus.byte(ADDR_WRITE, 0x20, NACK), bus.condition(STOP)]
+    result = decode(packets)
+
+    assert messages(result) == []
+    assert events(result, TRANSACTION) == []
+    assert [data for _, _, data in result.python()] == [data for _, _, data in packets]
+
+
+def test_foreign_traffic_forwarded():
+    bus = Bus()
+    foreign = list(bus.register_write(0x50, OUTPUT_REG, 0x01))
+    result = decode([*foreign, *bus.register_write(0x20, OUTPUT_REG, 0x00)])
+
+    assert messages(result) == ["PCA9534 at 0x20: Output pins pull up/down set to 0b00000000"]
+    assert [addr for addr, *_ in events(result, TRANSACTION)] == [0x20]
+    assert [data for _, _, data in result.python()][:len(foreign)] == [data for _, _, data in foreign]
+
+
+def test_foreign_traffic_dropped():
+    bus = Bus()
+    result = decode([*bus.register_write(0x50, OUTPUT_REG, 0x01), *bus.register_write(0x20, OUTPUT_REG, 0x00)], other_traffic=OTHER_DROP)
+
+    assert messages(result) == ["PCA9534 at 0x20: Output pins pull up/down set to 0b00000000"]
+    assert [data[0] for _, _, data in result.python()] == [START, ADDR_WRITE, ACK, DATA_WRITE, ACK, DATA_WRITE, ACK, STOP]
+
+
+def test_bits_ignored():
+    plain = Bus()
+    bits = Bus(bits=True)
+    packets = [*plain.pointer_write(0x20, INPUT_REG), *plain.read(0x20, 0x3C), *plain.register_write(0x20, CONFIG_REG, 0x00)]
+    with_bits = [*bits.pointer_write(0x20, INPUT_REG), *bits.read(0x20, 0x3C), *bits.register_write(0x20, CONFIG_REG, 0x00)]
+    expected = decode(packets)
+    result = decode(with_bits)
+
+    assert list(result.annotations()) == list(expected.annotations())
+    assert list(result.events()) == list(expected.events())
+    assert [data[0] for _, _, data in result.python()] == [data[0] for _, _, data in with_bits]
+
+
+def test_repeated_own_address_ignored():
+    # A missed repeated START: the register write is certain after its value byte,
+    # the stray address of the same device must not undo what was parsed.
+    bus = Bus()
+    packets = [
+        bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, OUTPUT_REG), *bus.byte(DATA_WRITE, 0x05),
+        *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, 0x07), bus.condition(STOP),
+    ]
+    result = decode(packets)
+
+    assert messages(result) == ["PCA9534 at 0x20: Output pins pull up/down set to 0b00000101"]
+    assert events(result, TRANSACTION) == [(0x20, DIR_WRITE, OUTPUT_REG, 0x05, True)]
+
+
+def _write_then_foreign_address(bus):
+    """A register write whose repeated START before a foreign address was missed."""
+    return [
+        bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, OUTPUT_REG), *bus.byte(DATA_WRITE, 0x05),
+        *bus.byte(ADDR_WRITE, 0x50), *bus.byte(DATA_WRITE, 0x07), bus.condition(STOP),
+    ]
+
+
+def test_foreign_address_mid_transaction():
+    packets = _write_then_foreign_address(Bus())
+
+    for other_traffic in (OTHER_FORWARD, OTHER_DROP):
+        result = decode(packets, other_traffic=other_traffic)
+        assert messages(result) == ["PCA9534 at 0x20: Output pins pull up/down set to 0b00000101"]
+        assert events(result, TRANSACTION) == [(0x20, DIR_WRITE, OUTPUT_REG, 0x05, True)]
+        # Part of our transaction, not another slave's segment
+        assert [data for _, _, data in result.python()] == [data for _, _, data in packets]
+
+
+def test_foreign_address_mid_transaction_streamed():
+    packets = _write_then_foreign_address(Bus())
+    expected = decode(packets)
+
+    streamed = list(batch.iter_decode(packets))
+    assert [(ss, es, data) for output_id, ss, es, data in streamed if output_id == batch.OUT_EVENTS] == list(expected.events())
+
+
+def test_foreign_address_forgets_pointer():
+    bus = Bus()
+    packets = [
+        *bus.pointer_write(0x20, CONFIG_REG),
+        bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, OUTPUT_REG), *bus.byte(ADDR_WRITE, 0x50), bus.condition(STOP),
+        *bus.read(0x20, 0x11),
+    ]
+    result = decode(packets)
+
+    # The pointer write was cut short, which register the read returns is not known
+    assert messages(result)[-1] == "PCA9534 at 0x20: Read data 0x11 from None register"
+    assert [text[1] for _, _, _, text in result.annotations() if text[0].startswith("WARN")] == ["WARN: unexpected ADDRESS WRITE"]
+
+
+def test_lost_stop_before_foreign_segment_dropped():
+    bus = Bus()
+    ours = bus.register_write(0x20, OUTPUT_REG, 0x05)[:-1]
+    foreign = bus.register_write(0x50, OUTPUT_REG, 0x07)
+    result = decode([*ours, *foreign, *bus.pointer_write(0x20, INPUT_REG)], other_traffic=OTHER_DROP)
+
+    assert messages(result)[0] == "PCA9534 at 0x20: Output pins pull up/down set to 0b00000101"
+    assert [data for _, _, data in result.python()][:len(ours)] == [data for _, _, data in ours]
+    assert len(result.py_data) == len(ours) + 6
+
+
+def test_violation_after_pointer_byte_forgets_pointer():
+    bus = Bus()
+    packets = [
+        *bus.pointer_write(0x20, CONFIG_REG),
+        bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, OUTPUT_REG), *bus.byte(ADDR_WRITE, 0x20), bus.condition(STOP),
+        *bus.read(0x20, 0x11),
+    ]
+    result = decode(packets)
+
+    assert messages(result)[-1] == "PCA9534 at 0x20: Read data 0x11 from None register"
+
+
+def test_violation_before_pointer_byte_keeps_pointer():
+    bus = Bus()
+    packets = [
+        *bus.pointer_write(0x20, CONFIG_REG),
+        bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(ADDR_WRITE, 0x20), bus.condition(STOP),
+        *bus.read(0x20, 0x11),
+    ]
+    result = decode(packets)
+
+    assert messages(result)[-1] == "PCA9534 at 0x20: Read data 0x11 from Config register"
+
+
+def test_end_of_capture_without_stop():
+    bus = Bus()
+    pointer = [bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, CONFIG_REG)]
+    result = decode(pointer)
+
+    # Only the STOP is missing, decoded as if it had been there
+    assert messages(result) == ["PCA9534 at 0x20: set to read from Config register"]
+    assert events(result, TRANSACTION) == [(0x20, DIR_WRITE, CONFIG_REG, None, True)]
+    assert not [text for _, _, _, text in result.annotations() if text[0].startswith("WARN")]
+    streamed = [data for output_id, _, _, data in batch.iter_decode(pointer) if output_id == batch.OUT_ANN]
+    assert sorted(streamed) == sorted([cls, text] for _, _, cls, text in result.annotations())
+
+    write = [bus.condition(START), *bus.byte(ADDR_WRITE, 0x20), *bus.byte(DATA_WRITE, OUTPUT_REG), *bus.byte(DATA_WRITE, 0x05)]
+    assert messages(decode(write)) == ["PCA9534 at 0x20: Output pins pull up/down set to 0b00000101"]
+
+
+def test_end_of_capture_incomplete():
+    bus = Bus()
+    result = decode([bus.condition(START), *bus.byte(ADDR_WRITE, 0x20)])
+
+    assert messages(result) == []
+    assert [text[0] for _, _, _, text in result.annotations()] == ["WARN: incomplete transaction at end of capture"]
+
+
+def test_stats_annotation():
+    bus = Bus()
+    packets = [*bus.register_write(0x20, OUTPUT_REG, 0x01), *bus.read(0x20, 0x02)]
+    options = {"stats": STATS_COUNTS, "stats_report": REPORT_ANNOTATION}
+
+    report = [text for _, _, cls, text in decode(packets, **options).annotations() if cls == ANN_STATS]
+    assert report == [[f"{len(packets)} packets, 2 messages, 0 failed, 1 NACKs", f"{len(packets)} packets, 2 messages", "2"]]
+
+    # Not even the report is annotated without annotations
+    assert list(decode(packets, annotations="no", **options).annotations()) == []
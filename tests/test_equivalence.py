@@ -0,0 +1,51 @@
+"""
+The streaming decodes against the plain batch decode, on clean and glitched
+traffic for PCA9534 and PCA9555 devices.
+"""
+
+import asyncio
+
+import pytest
+from conftest import SEEDS, TRAFFIC, traffic
+
+from i2c_pca9534 import batch
+from i2c_pca9534.batch import OUT_ANN, OUT_EVENTS, OUT_I2C
+
+
+def _by_output(items):
+    out = {OUT_ANN: [], OUT_I2C: [], OUT_EVENTS: []}
+    for output_id, ss, es, data in items:
+        out[output_id].append((ss, es, data))
+    return out
+
+
+def _assert_streamed(items, expected):
+    streamed = _by_output(items)
+    assert streamed[OUT_EVENTS] == list(expected.events())
+    assert streamed[OUT_I2C] == list(expected.python())
+    # A streamed transaction is annotated at its last byte, ahead of the conditions before it
+    annotations = [(ss, es, cls, text) for ss, es, (cls, text) in streamed[OUT_ANN]]
+    assert sorted(annotations) == sorted(expected.annotations())
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("name", TRAFFIC)
+def test_iter_decode(name, seed):
+    packets, options = traffic(name, seed)
+
+    _assert_streamed(batch.iter_decode(packets, options), batch.decode_packets(packets, options))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("name", TRAFFIC)
+def test_aiter_decode(name, seed):
+    packets, options = traffic(name, seed)
+
+    async def source():
+        for packet in packets:
+            yield packet
+
+    async def collect():
+        return [item async for item in batch.aiter_decode(source(), options)]
+
+    _assert_streamed(asyncio.run(collect()), batch.decode_packets(packets, options))
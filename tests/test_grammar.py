@@ -0,0 +1,43 @@
+"""The compiled grammar tables in pd.py against their source in grammar.py."""
+
+from i2c_pca9534 import grammar, pd
+
+
+def test_tables_match_grammar():
+    assert grammar.verify() == []
+
+
+def test_violation_states():
+    assert (pd.ERROR_STATE, pd.RESYNC_STATE) == (26, 27)
+    assert len(pd.TRANSITIONS) == (pd.ERROR_STATE + 1) * pd.N_COMMANDS
+
+
+def test_dump_grammar_rows():
+    rows = pd.dump_grammar()
+
+    assert len(rows) == pd.ERROR_STATE + 1
+    # A capture may begin mid-transfer, the root state only waits for a condition
+    assert rows[0] == "  0 [] START -> 1, START REPEAT -> 1, STOP -> 2"
+    # Register byte written: a value byte, a STOP or a repeated start may follow
+    assert rows[10] == " 10 [] START -> 27, START REPEAT -> 15, STOP -> 16, ACK -> 26, NACK -> 26, ADDRESS READ -> 26, ADDRESS WRITE -> 26, DATA READ -> 26, DATA WRITE -> 14"
+    # Read byte NACKed: the message is the same whether a STOP or a repeated start ends it
+    assert rows[13] == " 13 [] START -> 27, START REPEAT -> 20, STOP -> 19"
+    assert rows[20] == (
+        " 20 [msg_read_from_register] START -> 27, START REPEAT -> 27, ACK -> 26, NACK -> 26, ADDRESS READ -> 4, ADDRESS WRITE -> 3, DATA READ -> 26, DATA WRITE -> 26"
+    )
+    assert rows[pd.ERROR_STATE] == " 26 [] START -> 1, START REPEAT -> 1"
+
+
+def test_format_tables_round_trip():
+    namespace = {}
+    exec(grammar.format_tables(), namespace)  # pylint: disable=exec-used
+
+    assert namespace["TRANSITIONS"] == pd.TRANSITIONS
+    assert namespace["STATE_BUILDERS"] == pd.STATE_BUILDERS
+    assert namespace["EARLY_BUILDERS"] == pd.EARLY_BUILDERS
+    assert namespace["POINTER_SENT"] == pd.POINTER_SENT
+
+
+def test_pointer_sent():
+    # After the register byte of a write, up to the message of that write
+    assert [state for state, sent in enumerate(pd.POINTER_SENT) if sent] == [7, 10, 11, 14, 21, 22]
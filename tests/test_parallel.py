@@ -0,0 +1,75 @@
+"""decode_parallel() against decode_packets(), over packets and over packet files."""
+
+import pytest
+from conftest import SEEDS, TRAFFIC, Bus, traffic
+
+from i2c_pca9534 import batch
+from i2c_pca9534.pd import INPUT_REG
+
+CHUNK_PACKETS = 997  # Small enough for pointers and registers to be carried across chunks
+
+
+def _assert_same_result(result, expected):
+    assert list(result.annotations()) == list(expected.annotations())
+    assert list(result.events()) == list(expected.events())
+    assert list(result.python()) == list(expected.python())
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("name", TRAFFIC)
+def test_decode_parallel(name, seed):
+    packets, options = traffic(name, seed)
+    expected = batch.decode_packets(packets, options)
+
+    result = batch.decode_parallel(iter(packets), options, workers=2, chunk_packets=CHUNK_PACKETS, forwarded=True)
+
+    _assert_same_result(result, expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("name", TRAFFIC)
+def test_decode_parallel_file(name, seed, tmp_path):
+    packets, options = traffic(name, seed)
+    path = str(tmp_path / "capture.pkt")
+    batch.write_packets(path, packets)
+    expected = batch.decode_packets(packets, options)
+
+    result = batch.decode_parallel(path, options, workers=2, chunk_packets=CHUNK_PACKETS, forwarded=True)
+    _assert_same_result(result, expected)
+
+    # Without the forwarded packets the rest is unchanged
+    result = batch.decode_parallel(path, options, workers=2, chunk_packets=CHUNK_PACKETS)
+    assert list(result.events()) == list(expected.events())
+    assert list(result.python()) == []
+
+
+@pytest.mark.parametrize("name", TRAFFIC)
+def test_decode_parallel_without_events(name):
+    packets, options = traffic(name, 0)
+    options["events"] = "no"
+    expected = batch.decode_packets(packets, options)
+
+    result = batch.decode_parallel(iter(packets), options, workers=2, chunk_packets=50, forwarded=True)
+
+    _assert_same_result(result, expected)
+    assert list(result.events()) == []
+
+
+def test_decode_parallel_read_across_chunks():
+    bus = Bus()
+    # The pointer is set in the first chunk, the read that relies on it is in the second
+    packets = [*bus.pointer_write(0x20, INPUT_REG), *bus.read(0x20, 0x81)]
+    expected = batch.decode_packets(packets)
+
+    result = batch.decode_parallel(iter(packets), workers=2, chunk_packets=1)
+
+    assert list(result.annotations()) == list(expected.annotations())
+    assert list(result.events()) == list(expected.events())
+
+
+def test_decode_parallel_empty(tmp_path):
+    path = str(tmp_path / "empty.pkt")
+    batch.write_packets(path, [])
+
+    assert list(batch.decode_parallel(path, workers=2).annotations()) == []
+    assert list(batch.decode_parallel(iter([]), workers=2).annotations()) == []
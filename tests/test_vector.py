@@ -0,0 +1,46 @@
+"""decode_arrays() against export.export_transactions() of the plain decode."""
+
+import pytest
+from conftest import SEEDS, TRAFFIC, traffic
+
+np = pytest.importorskip("numpy")
+
+# pylint: disable=wrong-import-position
+from i2c_pca9534 import batch, export, vector  # noqa: E402
+from i2c_pca9534.batch import FILE_COMMANDS  # noqa: E402
+
+
+def _assert_same_table(table, expected):
+    assert table.keys() == expected.keys()
+    for name, column in expected.items():
+        assert table[name].dtype == column.dtype, name
+        assert np.array_equal(table[name], column), name
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("name", TRAFFIC)
+def test_decode_arrays(name, seed, tmp_path):
+    packets, options = traffic(name, seed)
+    export.export_transactions(packets, str(tmp_path), options)
+    expected = export.load_transactions(str(tmp_path), mmap=False)
+    codes = {cmd: code for code, cmd in enumerate(FILE_COMMANDS)}
+
+    table = vector.decode_arrays(
+        np.array([ss for ss, _, _ in packets], dtype=np.uint64),
+        np.array([es for _, es, _ in packets], dtype=np.uint64),
+        np.array([codes[cmd] for _, _, (cmd, _) in packets], dtype=np.uint8),
+        np.array([-1 if value is None else value for _, _, (_, value) in packets], dtype=np.int16),
+        options,
+    )
+
+    _assert_same_table(table, expected)
+
+
+@pytest.mark.parametrize("name", TRAFFIC)
+def test_decode_packet_file(name, tmp_path):
+    packets, options = traffic(name, 0)
+    path = str(tmp_path / "capture.pkt")
+    batch.write_packets(path, packets)
+    export.export_transactions(packets, str(tmp_path / "columns"), options)
+
+    _assert_same_table(vector.decode_packet_file(path, options), export.load_transactions(str(tmp_path / "columns"), mmap=False))